@@ -1,10 +1,9 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Dict, List
-from ml.models.inference import EnvironmentSimulator
+from ml.models.shared_model import get_simulator
 
 router = APIRouter()
-simulator = EnvironmentSimulator()
 
 class SimulationRequest(BaseModel):
     user_input: str
@@ -13,6 +12,9 @@ class SimulationRequest(BaseModel):
 @router.post("/simulate")
 async def simulate_environment(request: SimulationRequest):
     try:
+        # Look up per request so hot reloads are picked up
+        simulator = get_simulator()
+        
         # Process LLM input
         changes = simulator.process_llm_input(request.user_input)
         
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 from pymongo import MongoClient
@@ -7,11 +7,14 @@ import os
 from collections import Counter
 import vertexai
 from vertexai.generative_models import GenerativeModel
-from ml.models.inference import EnvironmentSimulator
+from ml.models.shared_model import get_simulator, start_reload, reload_status, watch_model_files
+from llm_cache import CachedModel, StubModel, cache_from_env
+from change_parser import parse_environmental_changes
 import numpy as np
 import json
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 
 # Load environment variables from .env
 load_dotenv()
@@ -19,67 +22,145 @@ load_dotenv()
 # Flask app initialization with SocketIO
 app = Flask(__name__)
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# A message queue lets every gunicorn worker emit to clients connected to the others
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=os.getenv("SOCKETIO_MESSAGE_QUEUE") or None)
 
-# Initialize environment simulator
+# Initialize environment simulator (shared with api/environment_routes.py)
 try:
-    simulator = EnvironmentSimulator()
+    get_simulator()
     print("✅ Successfully initialized Environment Simulator.")
 except Exception as e:
     print(f"❌ Error initializing Environment Simulator: {e}")
-    simulator = None
+
+def current_simulator():
+    """
+    The live simulator. Look it up per request: hot reloads swap it in place,
+    while requests already holding the old instance finish on it.
+    """
+    try:
+        return get_simulator()
+    except Exception as e:
+        print(f"❌ Environment Simulator unavailable: {e}")
+        return None
+
+# Optionally reload the model when retraining writes new artifacts
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "0"))
+if MODEL_WATCH_INTERVAL > 0:
+    watch_model_files(MODEL_WATCH_INTERVAL)
 
 # Store active simulations
 active_simulations = {}
 
-def emit_simulation_updates(simulation_id, changes):
-    """Background task to emit simulation updates"""
+# Limits for streamed simulations (backpressure instead of unbounded threads)
+MAX_CONCURRENT_SIMULATIONS = int(os.getenv("MAX_CONCURRENT_SIMULATIONS", "32"))
+MAX_SIMULATIONS_PER_CLIENT = int(os.getenv("MAX_SIMULATIONS_PER_CLIENT", "2"))
+
+class SimulationScheduler:
+    """
+    Runs streamed simulations as Socket.IO background tasks with a bounded
+    number of concurrent runs, per-client limits and cancellation.
+    """
+
+    def __init__(self, socketio, max_concurrent, max_per_client):
+        self.socketio = socketio
+        self.max_concurrent = max_concurrent
+        self.max_per_client = max_per_client
+        self._lock = threading.Lock()
+        self._running = {}  # simulation_id -> {'sid': ..., 'cancelled': threading.Event()}
+
+    def submit(self, simulation_id, sid, changes):
+        """Start a simulation for a client, or return an error message if at capacity"""
+        with self._lock:
+            if simulation_id in self._running:
+                return 'Simulation is already running'
+            if len(self._running) >= self.max_concurrent:
+                return 'Server is busy, please retry shortly'
+            if sum(1 for run in self._running.values() if run['sid'] == sid) >= self.max_per_client:
+                return 'Too many simulations running for this client'
+            cancelled = threading.Event()
+            self._running[simulation_id] = {'sid': sid, 'cancelled': cancelled}
+
+        self.socketio.start_background_task(self._run, simulation_id, sid, changes, cancelled)
+        return None
+
+    def cancel_client(self, sid):
+        """Cancel every simulation started by a client"""
+        with self._lock:
+            runs = [(simulation_id, run) for simulation_id, run in self._running.items() if run['sid'] == sid]
+        for simulation_id, run in runs:
+            run['cancelled'].set()
+        return [simulation_id for simulation_id, _ in runs]
+
+    def _run(self, simulation_id, sid, changes, cancelled):
+        try:
+            emit_simulation_updates(simulation_id, changes, sid, cancelled)
+        finally:
+            with self._lock:
+                self._running.pop(simulation_id, None)
+
+scheduler = SimulationScheduler(socketio, MAX_CONCURRENT_SIMULATIONS, MAX_SIMULATIONS_PER_CLIENT)
+
+def set_simulation_status(simulation_id, status):
+    """Update a simulation's status unless its client has already gone away"""
+    if simulation_id in active_simulations:
+        active_simulations[simulation_id]['status'] = status
+
+def emit_simulation_updates(simulation_id, changes, sid, cancelled):
+    """Background task to emit simulation updates to the client that started it"""
     try:
+        simulator = current_simulator()
+        
         # Initial state
-        current_state = {var: 50 for var in simulator.key_variables['environmental_state']}
+        baseline = {var: 50 for var in simulator.key_variables['environmental_state']}
+        current_state = dict(baseline)
         
         # Emit initial state
         socketio.emit('simulation_update', {
             'simulation_id': simulation_id,
             'state': current_state,
             'step': 0
-        })
+        }, to=sid)
         
-        # Simulate gradual changes over 10 steps
-        for step in range(1, 11):
-            # Calculate intermediate state
-            for var, target_change in changes.items():
-                step_change = target_change / 10
-                if var in current_state:
-                    current_state[var] += step_change
+        # Compute all 10 steps of gradual change in one batch, then pace them out
+        trajectory = simulator.simulate_trajectory(changes, steps=10)
+        impacts = {}
+        for point in trajectory:
+            if cancelled.is_set():
+                set_simulation_status(simulation_id, 'cancelled')
+                return
             
-            # Get impacts for current state
-            impacts = simulator.simulate_changes(current_state)
+            # Intermediate state for the variables being changed
+            current_state = {
+                var: value + point['changes'].get(var, 0)
+                for var, value in baseline.items()
+            }
+            impacts = point['impacts']
             
             # Emit update
             socketio.emit('simulation_update', {
                 'simulation_id': simulation_id,
                 'state': current_state,
                 'impacts': impacts,
-                'step': step
-            })
+                'step': point['step']
+            }, to=sid)
             
-            time.sleep(1)  # 1-second delay between updates
+            socketio.sleep(1)  # 1-second delay between updates, yields to other tasks
             
         # Mark simulation as complete
-        active_simulations[simulation_id]['status'] = 'complete'
+        set_simulation_status(simulation_id, 'complete')
         socketio.emit('simulation_complete', {
             'simulation_id': simulation_id,
             'final_state': current_state,
             'final_impacts': impacts
-        })
+        }, to=sid)
         
     except Exception as e:
         print(f"Error in simulation updates: {str(e)}")
+        set_simulation_status(simulation_id, 'error')
         socketio.emit('simulation_error', {
             'simulation_id': simulation_id,
             'error': str(e)
-        })
+        }, to=sid)
 
 @socketio.on('connect')
 def handle_connect():
@@ -88,17 +169,18 @@ def handle_connect():
 @socketio.on('disconnect')
 def handle_disconnect():
     print(f"Client disconnected: {request.sid}")
+    for simulation_id in scheduler.cancel_client(request.sid):
+        active_simulations.pop(simulation_id, None)
 
 @socketio.on('start_simulation')
 def handle_simulation_start(data):
     """Handle start of a new simulation"""
+    simulation_id = data.get('simulation_id', request.sid)
     try:
         message = data.get('message', '')
-        simulation_id = data.get('simulation_id', request.sid)
         
-        # Get LLM interpretation
-        initial_response = get_ai_response(message)
-        changes = parse_environmental_changes(initial_response)
+        # Get LLM interpretation (deterministic parsing if the LLM is slow)
+        changes, _, _ = interpret_message(message)
         
         if not changes:
             emit('simulation_error', {
@@ -107,19 +189,26 @@ def handle_simulation_start(data):
             })
             return
         
-        # Store simulation info
+        # Store simulation info first, so the task's status updates always find it
+        previous = active_simulations.get(simulation_id)
         active_simulations[simulation_id] = {
             'status': 'running',
             'changes': changes,
             'start_time': time.time()
         }
         
-        # Start background thread for updates
-        thread = threading.Thread(
-            target=emit_simulation_updates,
-            args=(simulation_id, changes)
-        )
-        thread.start()
+        # Schedule streamed updates; reject instead of queueing when at capacity
+        error = scheduler.submit(simulation_id, request.sid, changes)
+        if error:
+            if previous is None:
+                active_simulations.pop(simulation_id, None)
+            else:
+                active_simulations[simulation_id] = previous  # e.g. the run already in progress
+            emit('simulation_error', {
+                'simulation_id': simulation_id,
+                'error': error
+            })
+            return
         
         emit('simulation_started', {
             'simulation_id': simulation_id,
@@ -159,14 +248,24 @@ except Exception as e:
 
 messages = []
 
-# Initialize Vertex AI
+# Initialize Vertex AI (or the offline stub model when LLM_STUB is set)
+MODEL_NAME = "gemini-1.5-flash-002"
 try:
-    PROJECT_ID = "ecosim-451804"
-    vertexai.init(project=PROJECT_ID, location="us-central1")
-    model = GenerativeModel("gemini-1.5-flash-002")
-    print("✅ Successfully initialized Vertex AI.")
+    if os.getenv("LLM_STUB"):
+        model = StubModel()
+        MODEL_NAME = model.model_name
+        print("✅ Using offline stub model instead of Vertex AI.")
+    else:
+        PROJECT_ID = "ecosim-451804"
+        vertexai.init(project=PROJECT_ID, location="us-central1")
+        model = GenerativeModel(MODEL_NAME)
+        print("✅ Successfully initialized Vertex AI.")
 except Exception as e:
     print(f"❌ Error initializing Vertex AI: {e}")
+    model = None
+
+# Cache identical prompts and coalesce concurrent duplicates into one model call
+llm = CachedModel(model, cache_from_env(), model_name=MODEL_NAME)
 
 def get_ai_response(user_message, simulation_results=None):
     """
@@ -197,80 +296,97 @@ Extract any environmental changes they're proposing. Look for:
 If no specific changes are mentioned, ask for clarification about what environmental factors they'd like to modify."""
 
         print(f"Sending prompt to Vertex AI: {prompt}")  # Debug log
-        response = model.generate_content(prompt)
-        print(f"Received response from Vertex AI: {response.text}")  # Debug log
-        return response.text
+        response_text = llm.generate_text(prompt)
+        print(f"Received response from Vertex AI: {response_text}")  # Debug log
+        return response_text
     except Exception as e:
         print(f"Error generating AI response: {str(e)}")
         return "I apologize, but I'm having trouble processing your message right now."
 
-def parse_environmental_changes(llm_response):
+# Per-stage deadlines (seconds) for the /api/simulate pipeline
+INTERPRETATION_TIMEOUT = float(os.getenv("INTERPRETATION_TIMEOUT", "8"))
+SIMULATION_TIMEOUT = float(os.getenv("SIMULATION_TIMEOUT", "5"))
+ANALYSIS_TIMEOUT = float(os.getenv("ANALYSIS_TIMEOUT", "15"))
+REQUEST_BUDGET = float(os.getenv("REQUEST_BUDGET", "25"))
+
+# Shared pool for the LLM stages, so slow LLM calls never hold a request worker past its deadline
+pipeline_executor = ThreadPoolExecutor(max_workers=int(os.getenv("PIPELINE_WORKERS", "16")))
+# Separate pool for simulation: LLM calls that outlive their timeout keep running in the pool
+# above, and must not leave the (fast, CPU-bound) simulation queued behind them
+simulation_executor = ThreadPoolExecutor(max_workers=int(os.getenv("SIMULATION_WORKERS", "4")))
+
+def interpret_message(message, timeout=INTERPRETATION_TIMEOUT):
     """
-    Parse the LLM response to extract environmental changes with specific numerical values.
+    Get the LLM interpretation of a message and parse it into changes.
+    If the LLM misses its deadline, the deterministic parser runs on the raw message instead.
+    Returns (changes, interpretation_text, source).
     """
+    future = pipeline_executor.submit(get_ai_response, message)
     try:
-        # Comprehensive mapping of terms to our model variables
-        variable_mappings = {
-            # Environmental Pressure variables
-            ('pollution', 'pollutant', 'contamination'): 'calenviroscreen_3.0_results_june_2018_update__Pollution Burden Score',
-            ('traffic', 'vehicles', 'transportation'): 'calenviroscreen_3.0_results_june_2018_update__Traffic',
-            ('pesticide', 'herbicide', 'agricultural chemicals'): 'calenviroscreen_3.0_results_june_2018_update__Pesticides',
-            ('diesel', 'fuel emissions', 'exhaust'): 'calenviroscreen_3.0_results_june_2018_update__Diesel PM',
-            ('toxic', 'hazardous waste', 'chemical release'): 'calenviroscreen_3.0_results_june_2018_update__Tox. Release',
-            
-            # Environmental State variables
-            ('ozone', 'o3', 'smog'): 'calenviroscreen_3.0_results_june_2018_update__Ozone',
-            ('pm2.5', 'particulate matter', 'air particles'): 'calenviroscreen_3.0_results_june_2018_update__PM2.5',
-            ('biodiversity', 'species diversity', 'ecosystem diversity'): 'Species_Biodiversity___ACE_[ds2769]__SpBioRnkEco',
-            ('habitat', 'natural area', 'wildlife area'): 'Species_Biodiversity___ACE_[ds2769]__TerrHabRank'
+        initial_response = future.result(timeout=timeout)
+        return parse_environmental_changes(initial_response), initial_response, 'llm'
+    except FuturesTimeout:
+        print(f"Interpretation timed out after {timeout}s, falling back to direct parsing")
+        return parse_environmental_changes(message), None, 'fallback'
+
+def simulation_pipeline(message, uncertainty=False):
+    """
+    Run interpretation -> simulation -> analysis with per-stage timeouts and an
+    overall budget, yielding each stage's result as soon as it is ready.
+    With uncertainty, sampled means and credible intervals follow the impacts.
+    """
+    deadline = time.monotonic() + REQUEST_BUDGET
+    remaining = lambda limit: max(0.0, min(limit, deadline - time.monotonic()))
+    
+    changes, initial_response, source = interpret_message(message, remaining(INTERPRETATION_TIMEOUT))
+    if not changes:
+        yield {
+            "stage": "clarification",
+            "status": "clarification_needed",
+            "message": initial_response or "Could you describe which environmental factors you'd like to change, and by how much?"
         }
-        
-        import re
-        
-        # Pattern to match percentage changes
-        percentage_pattern = r'(increase|decrease|reduce|improve|lower|raise|change)\s+(?:in\s+)?(?:the\s+)?([a-zA-Z\s]+)\s+(?:by\s+)?(\d+)(?:\s*%|\s+percent)'
-        
-        # Pattern to match absolute value changes
-        absolute_pattern = r'(increase|decrease|reduce|improve|lower|raise|change)\s+(?:in\s+)?(?:the\s+)?([a-zA-Z\s]+)\s+(?:from|to)\s+(\d+)(?:\s*%|\s+percent)'
-        
-        changes = {}
-        
-        # Find all matches in the text
-        matches = re.finditer(percentage_pattern, llm_response.lower()) 
-        matches = list(matches) + list(re.finditer(absolute_pattern, llm_response.lower()))
-        
-        for match in matches:
-            action, term, value = match.groups()
-            value = float(value)
-            
-            # Convert action to direction
-            direction = 1 if action in ['increase', 'improve', 'raise'] else -1
-            
-            # Find matching variable
-            for terms, variable in variable_mappings.items():
-                if any(t in term for t in terms):
-                    changes[variable] = direction * value
-                    break
-        
-        # If no specific changes found but terms are mentioned, use default changes
-        if not changes:
-            for terms, variable in variable_mappings.items():
-                if any(t in llm_response.lower() for t in terms):
-                    # Default to 10% change, direction based on context
-                    direction = 1 if any(pos in llm_response.lower() for pos in ['increase', 'improve', 'better']) else -1
-                    changes[variable] = direction * 10
-        
-        print(f"Parsed changes: {changes}")  # Debug log
-        return changes
-        
-    except Exception as e:
-        print(f"Error parsing environmental changes: {str(e)}")
-        return {}
+        return
+    yield {"stage": "interpretation", "changes": changes, "source": source}
+    
+    simulator = current_simulator()
+    if not simulator:
+        yield {"stage": "error", "error": "Simulator not initialized"}
+        return
+    
+    try:
+        distributions = simulation_executor.submit(simulator.simulate_distributions, changes).result(
+            timeout=remaining(SIMULATION_TIMEOUT))
+    except FuturesTimeout:
+        yield {"stage": "error", "error": "Simulation timed out"}
+        return
+    # Point values plus the full posteriors behind them, from the same inference call
+    impacts = {var: (d['value'] if d else None) for var, d in distributions.items()}
+    yield {"stage": "impacts", "impacts": impacts, "distributions": distributions}
+    
+    if uncertainty:
+        try:
+            intervals = simulation_executor.submit(simulator.simulate_sampled, changes).result(
+                timeout=remaining(SIMULATION_TIMEOUT))
+        except FuturesTimeout:
+            intervals = None  # The point estimates above still stand
+        yield {"stage": "uncertainty", "uncertainty": intervals}
+    
+    # Get AI analysis of the results within what is left of the budget
+    try:
+        analysis = pipeline_executor.submit(get_ai_response, message, impacts).result(
+            timeout=remaining(ANALYSIS_TIMEOUT))
+        timed_out = False
+    except FuturesTimeout:
+        analysis = "The analysis is taking longer than expected. The simulated impacts are shown above."
+        timed_out = True
+    yield {"stage": "analysis", "analysis": analysis, "timed_out": timed_out}
 
 @app.route("/api/simulate", methods=["POST"])
 def simulate_changes():
     """
     Endpoint to simulate environmental changes based on user input.
+    With "stream": true the stages are returned as newline-delimited JSON, so the
+    impacts arrive before the analysis text.
     """
     try:
         data = request.json
@@ -278,40 +394,102 @@ def simulate_changes():
             return jsonify({"error": "No message provided"}), 400
 
         message = data['message']
+        uncertainty = bool(data.get('uncertainty'))
         
-        # First, get LLM interpretation of the message
-        initial_response = get_ai_response(message)
-        
-        # Parse the response to get environmental changes
-        changes = parse_environmental_changes(initial_response)
+        if data.get('stream'):
+            def generate():
+                for event in simulation_pipeline(message, uncertainty):
+                    yield json.dumps(event) + "\n"
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
         
-        if not changes:
-            return jsonify({
-                "status": "clarification_needed",
-                "message": initial_response
-            }), 200
+        result = {}
+        for event in simulation_pipeline(message, uncertainty):
+            if event["stage"] == "clarification":
+                return jsonify({
+                    "status": event["status"],
+                    "message": event["message"]
+                }), 200
+            if event["stage"] == "error":
+                return jsonify({"error": event["error"]}), 500
+            result.update({k: v for k, v in event.items() if k != "stage"})
         
-        # Run simulation if we have valid changes
-        if simulator:
-            impacts = simulator.simulate_changes(changes)
-            
-            # Get AI analysis of the results
-            analysis = get_ai_response(message, impacts)
-            
-            return jsonify({
-                "status": "success",
-                "changes": changes,
-                "impacts": impacts,
-                "analysis": analysis
-            }), 200
-        else:
-            return jsonify({"error": "Simulator not initialized"}), 500
+        response = {
+            "status": "success",
+            "changes": result["changes"],
+            "impacts": result["impacts"],
+            "distributions": result["distributions"],
+            "analysis": result["analysis"],
+            "interpretation_source": result["source"],
+            "analysis_timed_out": result["timed_out"]
+        }
+        if uncertainty:
+            response["uncertainty"] = result.get("uncertainty")
+        return jsonify(response), 200
             
     except Exception as e:
         return jsonify({"error": f"Failed to simulate changes: {str(e)}"}), 500
 
+@app.route("/api/simulate/counties", methods=["POST"])
+def simulate_counties():
+    """
+    Apply one set of changes to every county (or the "counties" listed) in a single
+    batch, starting from each county's observed values. Takes either "changes"
+    ({variable: percent change}) or a "message" to interpret.
+    """
+    try:
+        data = request.json
+        if not data or not (data.get('changes') or data.get('message')):
+            return jsonify({"error": "No changes or message provided"}), 400
+
+        changes = data.get('changes')
+        if not changes:
+            changes, initial_response, _ = interpret_message(data['message'])
+            if not changes:
+                return jsonify({
+                    "status": "clarification_needed",
+                    "message": initial_response or "Could you describe which environmental factors you'd like to change, and by how much?"
+                }), 200
+
+        simulator = current_simulator()
+        if not simulator:
+            return jsonify({"error": "Simulator not initialized"}), 500
+
+        impacts = simulation_executor.submit(simulator.simulate_counties, changes, data.get('counties')).result(
+            timeout=SIMULATION_TIMEOUT)
+        counties = {
+            str(county): {var: (None if value is None or value != value else value) for var, value in row.items()}
+            for county, row in impacts.iterrows()
+        }
+        return jsonify({"status": "success", "changes": changes, "counties": counties}), 200
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FuturesTimeout:
+        return jsonify({"error": "Simulation timed out"}), 500
+    except Exception as e:
+        return jsonify({"error": f"Failed to simulate counties: {str(e)}"}), 500
+
 # ======== ROUTES ========
 
+@app.route("/api/model/reload", methods=["POST"])
+def reload_model():
+    """
+    Rebuild the simulator from the current model artifacts in the background,
+    warm its caches and swap it in without dropping connections.
+    Only the worker process serving this request reloads; with several gunicorn
+    workers use MODEL_WATCH_INTERVAL so every worker picks up the new model.
+    """
+    started = start_reload()
+    return jsonify({
+        "status": "reloading" if started else "reload_in_progress",
+        "model": reload_status
+    }), 202
+
+@app.route("/api/model/status", methods=["GET"])
+def model_status():
+    """Returns the state of the live model and of the last reload in this worker process."""
+    return jsonify(reload_status), 200
+
 @app.route("/api/hello", methods=["GET"])
 def hello_world():
     """ Basic endpoint to confirm Flask server is running. """
@@ -404,6 +582,7 @@ def get_variables():
     Returns available environmental variables that can be modified.
     """
     try:
+        simulator = current_simulator()
         if not simulator:
             return jsonify({"error": "Simulator not initialized"}), 500
             
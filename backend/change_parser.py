@@ -0,0 +1,100 @@
+import json
+import os
+import re
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "variable_synonyms.json")
+
+
+class ChangeMatcher:
+    """
+    Extracts (action, variable, value) changes from free text in a single pass.
+    Actions and synonyms come from a config file and are compiled once into
+    alternation regexes instead of being rebuilt and scanned on every call.
+    """
+
+    def __init__(self, variables, actions, positive_terms, default_change=10):
+        self.actions = actions
+        self.default_change = default_change
+
+        # Each synonym maps to its variable; priority follows the config order
+        self.synonyms = {}
+        self.priority = {}
+        for rank, (variable, terms) in enumerate(variables.items()):
+            self.priority[variable] = rank
+            for term in terms:
+                self.synonyms.setdefault(term.lower(), variable)
+
+        action_alternation = "|".join(re.escape(a) for a in sorted(actions, key=len, reverse=True))
+        # One pattern covers both "by N%" (percentage) and "from/to N%" (absolute) phrasings
+        self.change_pattern = re.compile(
+            rf"({action_alternation})\s+(?:in\s+)?(?:the\s+)?([a-zA-Z\s]+)\s+"
+            rf"(?:(?:by|from|to)\s+)?(\d+)(?:\s*%|\s+percent)"
+        )
+        # Longest synonyms first so multi-word terms win over their prefixes
+        self.synonym_pattern = re.compile(
+            "|".join(re.escape(s) for s in sorted(self.synonyms, key=len, reverse=True))
+        )
+        self.positive_pattern = re.compile("|".join(re.escape(t) for t in positive_terms))
+
+    @classmethod
+    def from_config(cls, path=DEFAULT_CONFIG_PATH):
+        with open(path, "r") as f:
+            config = json.load(f)
+        return cls(
+            variables=config["variables"],
+            actions=config["actions"],
+            positive_terms=config.get("positive_terms", []),
+            default_change=config.get("default_change", 10)
+        )
+
+    def match_variable(self, term):
+        """Return the highest-priority variable whose synonym appears in the term"""
+        variables = {self.synonyms[m.group(0)] for m in self.synonym_pattern.finditer(term)}
+        if not variables:
+            return None
+        return min(variables, key=self.priority.get)
+
+    def extract(self, text):
+        """Return the list of (action, variable, value) triples found in the text"""
+        text = text.lower()
+        triples = []
+        for match in self.change_pattern.finditer(text):
+            action, term, value = match.groups()
+            variable = self.match_variable(term)
+            if variable:
+                triples.append((action, variable, float(value)))
+        return triples
+
+    def parse(self, text):
+        """Map text to {variable: signed change}"""
+        text = text.lower()
+        changes = {}
+        for action, variable, value in self.extract(text):
+            changes[variable] = self.actions[action] * value
+
+        # If no specific changes found but terms are mentioned, use default changes
+        if not changes:
+            mentioned = {self.synonyms[m.group(0)] for m in self.synonym_pattern.finditer(text)}
+            if mentioned:
+                # Default change, direction based on context
+                direction = 1 if self.positive_pattern.search(text) else -1
+                for variable in sorted(mentioned, key=self.priority.get):
+                    changes[variable] = direction * self.default_change
+        return changes
+
+
+matcher = ChangeMatcher.from_config(os.getenv("VARIABLE_SYNONYMS_PATH", DEFAULT_CONFIG_PATH))
+
+
+def parse_environmental_changes(llm_response):
+    """
+    Parse the LLM response to extract environmental changes with specific numerical values.
+    """
+    try:
+        changes = matcher.parse(llm_response)
+        print(f"Parsed changes: {changes}")  # Debug log
+        return changes
+
+    except Exception as e:
+        print(f"Error parsing environmental changes: {str(e)}")
+        return {}
@@ -0,0 +1,23 @@
+import os
+from ml.models.shared_model import publish_bundle
+
+# Workers attach read-only to the artifacts published by the master process,
+# so the CPD arrays and compiled table are held in memory once.
+bind = os.getenv("BIND", "0.0.0.0:5000")
+worker_class = os.getenv("WORKER_CLASS", "eventlet")
+
+# Socket.IO sessions live in one worker. More than one worker needs
+# SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0) so emits reach every
+# worker, plus sticky sessions at the load balancer (or websocket-only clients),
+# otherwise polling clients fail with "Invalid session".
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+if workers > 1 and not os.getenv("SOCKETIO_MESSAGE_QUEUE"):
+    raise RuntimeError("WEB_CONCURRENCY > 1 requires SOCKETIO_MESSAGE_QUEUE for Socket.IO")
+
+# /api/model/reload only reaches one worker, so with several every worker watches for retrains
+if workers > 1:
+    os.environ.setdefault("MODEL_WATCH_INTERVAL", "10")
+
+def on_starting(server):
+    """Runs once in the master before any worker is forked"""
+    publish_bundle()
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class PromptCache:
+    """
+    Prompt-keyed response cache with a TTL and a size limit.
+    Entries live in memory and, when a path is given, in a SQLite file so
+    they survive restarts.
+    """
+
+    def __init__(self, ttl=3600, maxsize=512, path=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (created, text)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created REAL, text TEXT)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def key(model_name, prompt):
+        return hashlib.sha256(f"{model_name}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT created, text FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    entry = (row[0], row[1])
+                    self._entries[key] = entry
+            if entry is None:
+                return None
+            if self._expired(entry[0]):
+                self._delete(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, text):
+        created = time.time()
+        with self._lock:
+            self._entries[key] = (created, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO responses (key, created, text) VALUES (?, ?, ?)",
+                        (key, created, text)
+                    )
+                    # Keep only the newest maxsize rows on disk
+                    self._db.execute(
+                        "DELETE FROM responses WHERE key NOT IN "
+                        "(SELECT key FROM responses ORDER BY created DESC LIMIT ?)",
+                        (self.maxsize,)
+                    )
+                    self._db.commit()
+                except sqlite3.Error:
+                    self._db.rollback()  # Leave the connection usable for the next write
+                    raise
+
+    def _delete(self, key):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single call"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> {'done': Event, 'result': ..., 'error': ...}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['done'].set()
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """
+    Offline stand-in for GenerativeModel. Echoes the quoted user message so the
+    change parser and simulator can be exercised without Vertex AI.
+    """
+
+    model_name = "stub"
+
+    def generate_content(self, prompt):
+        quoted = re.search(r'"([^"]*)"', prompt)
+        message = quoted.group(1) if quoted else prompt
+        return StubResponse(f"Proposed change: {message}")
+
+
+class CachedModel:
+    """Wraps a generative model with a prompt cache and single-flight coalescing"""
+
+    def __init__(self, model, cache, model_name=None):
+        self.model = model
+        self.cache = cache
+        self.model_name = model_name or getattr(model, "model_name", type(model).__name__)
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key):
+        """Cached text for key; an unreadable (e.g. locked) cache file counts as a miss"""
+        try:
+            return self.cache.get(key)
+        except sqlite3.Error as e:
+            print(f"Warning: could not read LLM cache: {e}")
+            return None
+
+    def generate_text(self, prompt):
+        """Return the model's text for a prompt, calling the model only on a cache miss"""
+        key = self.cache.key(self.model_name, prompt)
+        text = self._cached(key)
+        if text is not None:
+            self.hits += 1
+            return text
+        self.misses += 1
+
+        def call():
+            # Another caller may have filled the cache while we waited to lead
+            cached = self._cached(key)
+            if cached is not None:
+                return cached
+            response_text = self.model.generate_content(prompt).text
+            try:
+                self.cache.put(key, response_text)
+            except sqlite3.Error as e:
+                # The answer is already paid for; a shared cache file may just be locked by another worker
+                print(f"Warning: could not cache LLM response: {e}")
+            return response_text
+
+        return self._flight.do(key, call)
+
+
+def cache_from_env():
+    """Build a PromptCache from LLM_CACHE_TTL, LLM_CACHE_SIZE and LLM_CACHE_PATH"""
+    return PromptCache(
+        ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+        maxsize=int(os.getenv("LLM_CACHE_SIZE", "512")),
+        path=os.getenv("LLM_CACHE_PATH") or None
+    )
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import json
+from models.merged_data import merged_data_path, read_merged_data
 
 def get_numeric_stats(series):
     """Calculate statistics for numeric columns"""
@@ -68,7 +69,7 @@ def categorize_variable(col_name: str) -> str:
 def analyze_dataset():
     """Analyze the merged dataset and categorize variables"""
     print("[INFO] Loading merged dataset...")
-    df = pd.read_csv('merged_california_data.csv')
+    df = read_merged_data(merged_data_path('.'))
     
     # Analyze each column
     analysis = {}
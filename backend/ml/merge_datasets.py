@@ -1,6 +1,7 @@
 import os
 import pandas as pd
 import numpy as np
+from models.merged_data import MERGED_CSV, MERGED_PARQUET
 
 def aggregate_by_county(df: pd.DataFrame, file_name: str) -> pd.DataFrame:
     """Aggregate data by county using appropriate methods for different columns"""
@@ -35,13 +36,14 @@ def aggregate_by_county(df: pd.DataFrame, file_name: str) -> pd.DataFrame:
     print(f"[INFO] Reduced from {len(df)} to {len(aggregated)} rows")
     return aggregated
 
-def merge_processed_datasets():
+def merge_processed_datasets(export_csv=False):
     """
     Merges all processed datasets from the processed_datasets directory
     using County No. as the key for joining.
+    Writes Parquet (typed, readable column by column); export_csv also writes a CSV copy.
     """
     processed_dir = "./processed_datasets"
-    output_file = "merged_california_data.csv"
+    output_file = MERGED_PARQUET
     
     # Get list of all processed CSV files
     csv_files = [f for f in os.listdir(processed_dir) if f.endswith('.csv')]
@@ -125,8 +127,11 @@ def merge_processed_datasets():
         try:
             # Save merged dataset
             print("\n[INFO] Saving merged dataset...")
-            merged_df.to_csv(output_file, index=False)
+            merged_df.to_parquet(output_file, index=False)
             print(f"[SUCCESS] Saved merged dataset to {output_file}")
+            if export_csv:
+                merged_df.to_csv(MERGED_CSV, index=False)
+                print(f"[SUCCESS] Exported CSV copy to {MERGED_CSV}")
             print(f"Final shape: {merged_df.shape}")
             
             # Print summary
@@ -142,5 +147,11 @@ def merge_processed_datasets():
         print("\n[ERROR] No valid datasets were found to merge")
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Merge the processed datasets by county")
+    parser.add_argument('--csv', action='store_true', help=f"Also export {MERGED_CSV}")
+    args = parser.parse_args()
+    
     print("[INFO] Starting dataset merge process...")
-    merge_processed_datasets() 
\ No newline at end of file
+    merge_processed_datasets(export_csv=args.csv)
@@ -0,0 +1,282 @@
+import json
+import os
+import hashlib
+import shutil
+import tempfile
+import time
+import numpy as np
+
+BUNDLE_DIR = 'bundle'
+MANIFEST_FILE = 'manifest.json'
+BUNDLE_VERSION = 1
+
+
+def cpd_tables(model):
+    """Extract every CPD of a fitted network as plain arrays for NumPy inference"""
+    tables = {}
+    for cpd in model.get_cpds():
+        tables[cpd.variable] = {
+            'values': cpd.values,  # axes follow cpd.variables: [variable, *parents]
+            'variables': list(cpd.variables),
+            'states': {var: list(cpd.state_names[var]) for var in cpd.variables}
+        }
+    return tables
+
+
+def export_discretizers(discretizers):
+    """Copy the fitted scaler/discretizer parameters into plain NumPy arrays.
+
+    RobustScaler is x -> (x - center) / scale and KBinsDiscretizer is a
+    searchsorted over the inner bin edges, so both directions can run on
+    whole columns without sklearn's per-call validation.
+    """
+    exported = {}
+    for var, discretizer in discretizers.items():
+        if not isinstance(discretizer, dict):
+            continue
+        if 'type' in discretizer:  # Categorical variable
+            mapping = discretizer['mapping']
+            exported[var] = {
+                'type': 'categorical',
+                'mapping': mapping,
+                'reverse': {v: k for k, v in mapping.items()}
+            }
+        elif 'bin_edges' in discretizer:  # Plain parameters from preprocessing.py
+            edges = np.asarray(discretizer['bin_edges'], dtype=float)
+            exported[var] = {
+                'type': 'numeric',
+                'center': float(discretizer['center']),
+                'scale': float(discretizer['scale']),
+                'inner_edges': edges[1:-1],
+                'bin_centers': (edges[1:] + edges[:-1]) * 0.5
+            }
+        else:
+            edges = np.asarray(discretizer['discretizer'].bin_edges_[0], dtype=float)
+            exported[var] = {
+                'type': 'numeric',
+                'center': float(discretizer['scaler'].center_[0]),
+                'scale': float(discretizer['scaler'].scale_[0]),
+                'inner_edges': edges[1:-1],
+                'bin_centers': (edges[1:] + edges[:-1]) * 0.5
+            }
+    return exported
+
+
+def sha256_file(path):
+    """Hex sha256 of a file, read in 1MB chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def to_json_value(value):
+    """NumPy scalars (e.g. state names) as plain JSON values"""
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _read_manifest(bundle_dir):
+    path = os.path.join(bundle_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _array_dirs(manifest):
+    """Directories (relative to the bundle) holding the arrays a manifest points to"""
+    dirs = set()
+    for info in manifest['variables'].values():
+        for relative_path in (info['files'].values() if info.get('type') == 'sparse' else [info['file']]):
+            dirs.add(os.path.dirname(relative_path))
+    return dirs
+
+
+def export_bundle(tables, bins, key_variables, bundle_dir):
+    """Write the network as a versioned bundle of .npy CPD arrays plus a JSON manifest.
+
+    The manifest holds the variable index, parents, state names, bin
+    parameters and a sha256 per array, so loading needs neither pickle nor
+    pgmpy/sklearn and the arrays can be memory-mapped.
+
+    Arrays are never rewritten in place: they are staged, renamed into a new
+    cpds-<checksum> directory, and the manifest is then replaced atomically.
+    Running servers keep their mappings of the previous arrays, and loaders
+    always see a manifest together with the arrays it describes.
+    """
+    os.makedirs(bundle_dir, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix='.cpds-', dir=bundle_dir)
+    os.chmod(staging_dir, 0o755)  # mkdtemp is owner-only; servers may run as another user
+
+    variables = {}
+    for idx, (var, table) in enumerate(tables.items()):
+        states = {v: [to_json_value(s) for s in states] for v, states in table['states'].items()}
+        if table.get('type') == 'sparse':
+            # Sparse CPDs (see sparse_cpd.py) are stored as their observed rows plus the default row
+            files = {}
+            for part, dtype in (('keys', np.int64), ('rows', np.float64), ('default', np.float64)):
+                files[part] = f'{idx:03d}.{part}.npy'
+                np.save(os.path.join(staging_dir, files[part]),
+                        np.ascontiguousarray(table[part], dtype=dtype), allow_pickle=False)
+            variables[var] = {
+                'type': 'sparse',
+                'files': files,
+                'variables': table['variables'],
+                'states': states,
+                'cards': [int(c) for c in table['cards']],
+                'sha256': {part: sha256_file(os.path.join(staging_dir, f)) for part, f in files.items()}
+            }
+            continue
+        
+        name = f'{idx:03d}.npy'
+        path = os.path.join(staging_dir, name)
+        np.save(path, np.ascontiguousarray(table['values'], dtype=np.float64), allow_pickle=False)
+        variables[var] = {
+            'file': name,
+            'variables': table['variables'],
+            'states': states,
+            'shape': list(table['values'].shape),
+            'sha256': sha256_file(path)
+        }
+
+    exported_bins = {}
+    for var, params in bins.items():
+        if params['type'] == 'categorical':
+            exported_bins[var] = {
+                'type': 'categorical',
+                'mapping': [[to_json_value(k), to_json_value(v)] for k, v in params['mapping'].items()]
+            }
+        else:
+            exported_bins[var] = {
+                'type': 'numeric',
+                'center': params['center'],
+                'scale': params['scale'],
+                'inner_edges': np.asarray(params['inner_edges']).tolist(),
+                'bin_centers': np.asarray(params['bin_centers']).tolist()
+            }
+
+    # The checksum covers every array digest, so it identifies the model contents
+    checksum = hashlib.sha256(
+        json.dumps({var: info['sha256'] for var, info in variables.items()}, sort_keys=True).encode()
+    ).hexdigest()
+    array_dir = f'cpds-{checksum[:16]}'
+    if os.path.exists(os.path.join(bundle_dir, array_dir)):
+        shutil.rmtree(staging_dir)  # Same arrays as an earlier export
+    else:
+        os.rename(staging_dir, os.path.join(bundle_dir, array_dir))
+    for info in variables.values():
+        if info.get('type') == 'sparse':
+            info['files'] = {part: os.path.join(array_dir, f) for part, f in info['files'].items()}
+        else:
+            info['file'] = os.path.join(array_dir, info['file'])
+
+    manifest = {
+        'version': BUNDLE_VERSION,
+        'created': time.time(),
+        'key_variables': key_variables,
+        'variables': variables,
+        'bins': exported_bins,
+        'checksum': checksum
+    }
+
+    previous = _read_manifest(bundle_dir)
+    manifest_path = os.path.join(bundle_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    # Keep the previous manifest's arrays for loaders that read it just before the swap.
+    # Older ones are unlinked; servers still mapping them keep their pages until they reload.
+    keep = {array_dir} | (_array_dirs(previous) if previous else set())
+    for name in os.listdir(bundle_dir):
+        path = os.path.join(bundle_dir, name)
+        if os.path.isdir(path) and name.startswith('cpds') and name not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+    print(f"[SUCCESS] Exported {len(variables)} CPDs to {bundle_dir}")
+    return manifest
+
+
+def copy_bundle(bundle_dir, destination):
+    """Copy the current manifest (byte for byte) and only the arrays it references"""
+    with open(os.path.join(bundle_dir, MANIFEST_FILE), 'rb') as f:
+        raw_manifest = f.read()
+    manifest = json.loads(raw_manifest)
+    os.makedirs(destination, exist_ok=True)
+    for array_dir in _array_dirs(manifest):
+        shutil.copytree(os.path.join(bundle_dir, array_dir), os.path.join(destination, array_dir))
+    with open(os.path.join(destination, MANIFEST_FILE), 'wb') as f:
+        f.write(raw_manifest)
+    return manifest
+
+
+def _load_sparse(bundle_dir, var, info, mmap_mode, verify):
+    table = {'type': 'sparse', 'variables': info['variables'], 'states': info['states'], 'cards': info['cards']}
+    for part, relative_path in info['files'].items():
+        path = os.path.join(bundle_dir, relative_path)
+        if verify and sha256_file(path) != info['sha256'][part]:
+            raise ValueError(f"Checksum mismatch for sparse CPD of {var}")
+        table[part] = np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+    if table['rows'].shape != (len(table['keys']), info['cards'][0]):
+        raise ValueError(f"Sparse CPD of {var} does not match its manifest cards")
+    return table
+
+
+def load_bundle(bundle_dir, mmap_mode='r', verify=False):
+    """Load a bundle exported by export_bundle.
+
+    Returns (tables, bins, key_variables, manifest). CPD arrays are memory-mapped
+    read-only by default; verify=True also checks every array's sha256.
+    """
+    with open(os.path.join(bundle_dir, MANIFEST_FILE), 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != BUNDLE_VERSION:
+        raise ValueError(f"Unsupported bundle version {manifest.get('version')}, expected {BUNDLE_VERSION}")
+
+    tables = {}
+    for var, info in manifest['variables'].items():
+        if info.get('type') == 'sparse':
+            tables[var] = _load_sparse(bundle_dir, var, info, mmap_mode, verify)
+            continue
+        path = os.path.join(bundle_dir, info['file'])
+        if verify and sha256_file(path) != info['sha256']:
+            raise ValueError(f"Checksum mismatch for CPD of {var}")
+        values = np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+        if list(values.shape) != info['shape']:
+            raise ValueError(f"CPD of {var} does not match its manifest shape")
+        tables[var] = {
+            'values': values,
+            'variables': info['variables'],
+            'states': info['states']
+        }
+
+    bins = {}
+    for var, params in manifest['bins'].items():
+        if params['type'] == 'categorical':
+            mapping = {k: v for k, v in params['mapping']}
+            bins[var] = {'type': 'categorical', 'mapping': mapping, 'reverse': {v: k for k, v in mapping.items()}}
+        else:
+            bins[var] = {
+                'type': 'numeric',
+                'center': params['center'],
+                'scale': params['scale'],
+                'inner_edges': np.asarray(params['inner_edges'], dtype=float),
+                'bin_centers': np.asarray(params['bin_centers'], dtype=float)
+            }
+
+    return tables, bins, manifest['key_variables'], manifest
+
+
+if __name__ == "__main__":
+    import argparse
+    from inference import EnvironmentSimulator, MODEL_DIR
+
+    parser = argparse.ArgumentParser(description="Export the pickled model as a fast-start artifact bundle")
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--out', default=None, help="Bundle directory (defaults to <model-dir>/bundle)")
+    args = parser.parse_args()
+
+    simulator = EnvironmentSimulator(model_dir=args.model_dir, use_bundle=False)
+    export_bundle(simulator.tables, simulator.bins, simulator.key_variables,
+                  args.out or os.path.join(args.model_dir, BUNDLE_DIR))
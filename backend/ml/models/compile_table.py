@@ -0,0 +1,203 @@
+import json
+import os
+import time
+import numpy as np
+
+try:
+    from .sparse_cpd import densify
+    from .artifact_bundle import sha256_file, to_json_value
+except ImportError:
+    from sparse_cpd import densify
+    from artifact_bundle import sha256_file, to_json_value
+
+TABLE_FILE = 'compiled_table.npy'
+MANIFEST_FILE = 'compiled_table.json'
+TABLE_VERSION = 1
+
+
+def _file_fingerprint(path, with_hash=True):
+    """Size, mtime and (optionally) sha256 of a model artifact"""
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if with_hash:
+        fingerprint['sha256'] = sha256_file(path)
+    return fingerprint
+
+
+def _extend(values, axis, keep):
+    """Keep the selected states of an axis and append its sum as an 'unobserved' slot"""
+    total = values.sum(axis=axis, keepdims=True)
+    return np.concatenate([np.take(values, keep, axis=axis), total], axis=axis)
+
+
+def compile_table(tables, key_variables, reachable_states, model_dir, artifact_files):
+    """Precompute impact marginals for every reachable evidence combination.
+
+    Each input (pressure/state) axis holds its reachable states plus a final
+    slot for "not observed". Impacts are leaves, so the joint over all inputs
+    J = prod P(input | parents) is built once and every slot combination is
+    obtained by summing J * P(impact | parents) over the unobserved axes.
+    """
+    inputs = key_variables['environmental_pressure'] + key_variables['environmental_state']
+    impacts = key_variables['impact']
+    if set(tables) != set(inputs) | set(impacts):
+        raise ValueError("Compiled tables require a network over exactly the key variables")
+
+    axis_ids = {var: idx for idx, var in enumerate(inputs + impacts)}
+    states = {var: tables[var]['states'][var] for var in tables}
+    keep = {var: [states[var].index(s) for s in reachable_states[var]] for var in inputs}
+
+    print("[INFO] Building joint distribution over input variables...")
+    operands = []
+    for var in inputs:
+        operands += [densify(tables[var]), [axis_ids[v] for v in tables[var]['variables']]]
+    joint = np.einsum(*operands, [axis_ids[v] for v in inputs], optimize='greedy')
+
+    def extend_inputs(values):
+        for axis, var in enumerate(inputs):
+            values = _extend(values, axis, keep[var])
+        return values
+
+    evidence_prob = extend_inputs(joint)
+    shape = evidence_prob.shape
+
+    offsets = {}
+    total_states = 0
+    for var in impacts:
+        offsets[var] = total_states
+        total_states += len(states[var])
+
+    # Build under a temporary name: a running server may have the current table memory-mapped
+    table_path = os.path.join(model_dir, TABLE_FILE)
+    staging_path = table_path + '.tmp'
+    table = np.lib.format.open_memmap(staging_path, mode='w+', dtype=np.float32, shape=shape + (total_states,))
+    for var in impacts:
+        print(f"[INFO] Compiling marginals for {var}")
+        cpd = tables[var]
+        weighted = np.einsum(joint, [axis_ids[v] for v in inputs],
+                             densify(cpd), [axis_ids[v] for v in cpd['variables']],
+                             [axis_ids[v] for v in inputs] + [axis_ids[var]], optimize='greedy')
+        marginals = extend_inputs(weighted) / evidence_prob[..., None]
+        table[..., offsets[var]:offsets[var] + len(states[var])] = marginals
+    table.flush()
+    del table
+    os.replace(staging_path, table_path)
+
+    manifest = {
+        'version': TABLE_VERSION,
+        'created': time.time(),
+        'inputs': inputs,
+        'slots': {var: [to_json_value(s) for s in reachable_states[var]] for var in inputs},
+        'impacts': {var: {'offset': offsets[var], 'states': [to_json_value(s) for s in states[var]]}
+                    for var in impacts},
+        'shape': list(shape) + [total_states],
+        'model': {name: _file_fingerprint(os.path.join(model_dir, name)) for name in artifact_files}
+    }
+    manifest_path = os.path.join(model_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    print(f"[SUCCESS] Compiled {int(np.prod(shape))} evidence combinations into {table_path}")
+    return manifest
+
+
+class CompiledTable:
+    """Memory-mapped impact marginals indexed by discrete evidence"""
+
+    def __init__(self, table, manifest):
+        self.table = table
+        self.manifest = manifest
+        self.inputs = manifest['inputs']
+        self.slots = {var: {state: pos for pos, state in enumerate(slots)}
+                      for var, slots in manifest['slots'].items()}
+        self.impacts = manifest['impacts']
+
+    @classmethod
+    def load(cls, model_dir, artifact_files):
+        """Load the compiled table, or return None when it is missing or stale"""
+        manifest_path = os.path.join(model_dir, MANIFEST_FILE)
+        table_path = os.path.join(model_dir, TABLE_FILE)
+        if not (os.path.exists(manifest_path) and os.path.exists(table_path)):
+            return None
+
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != TABLE_VERSION or set(manifest['model']) != set(artifact_files) \
+                or cls.is_stale(manifest, model_dir):
+            print("Warning: Compiled table is stale, run compile_table.py to rebuild it")
+            return None
+
+        table = np.load(table_path, mmap_mode='r')
+        if list(table.shape) != manifest['shape']:
+            print("Warning: Compiled table does not match its manifest")
+            return None
+        return cls(table, manifest)
+
+    @staticmethod
+    def is_stale(manifest, model_dir):
+        """Compare the model artifacts against the fingerprints recorded at compile time"""
+        for name, recorded in manifest['model'].items():
+            path = os.path.join(model_dir, name)
+            if not os.path.exists(path):
+                return True
+            current = _file_fingerprint(path, with_hash=False)
+            if current['size'] != recorded['size']:
+                return True
+            # Only hash when the cheap check is inconclusive (e.g. the file was copied)
+            if current['mtime'] != recorded['mtime'] and \
+                    _file_fingerprint(path)['sha256'] != recorded['sha256']:
+                return True
+        return False
+
+    def lookup(self, evidence):
+        """Return {impact: (marginal, states)}, or None if the evidence is not compiled"""
+        if any(var not in self.slots for var in evidence):
+            return None
+
+        index = []
+        for var in self.inputs:
+            slots = self.slots[var]
+            if var not in evidence:
+                index.append(len(slots))
+            elif evidence[var] in slots:
+                index.append(slots[evidence[var]])
+            else:
+                return None
+
+        row = self.table[tuple(index)]
+        return {
+            var: (np.asarray(row[info['offset']:info['offset'] + len(info['states'])]), info['states'])
+            for var, info in self.impacts.items()
+        }
+
+
+def reachable_states(simulator, all_states=False, low=0, high=100):
+    """States each input can take from simulate_changes inputs clipped to [low, high]"""
+    reachable = {}
+    for var in simulator.key_variables['environmental_pressure'] + simulator.key_variables['environmental_state']:
+        states = simulator.tables[var]['states'][var]
+        if all_states:
+            reachable[var] = list(states)
+            continue
+        lo = simulator._discretize_input(var, low)
+        hi = simulator._discretize_input(var, high)
+        reachable[var] = [s for s in states if lo <= s <= hi]
+    return reachable
+
+
+if __name__ == "__main__":
+    import argparse
+    from inference import EnvironmentSimulator
+
+    parser = argparse.ArgumentParser(description="Precompute impact marginals for the discrete evidence space")
+    parser.add_argument('--all-states', action='store_true',
+                        help="Compile every input state, not only those reachable from 0-100 inputs")
+    args = parser.parse_args()
+
+    simulator = EnvironmentSimulator()
+    if simulator.impact_query is None:
+        raise SystemExit("[ERROR] Network structure does not support compiled tables")
+    compile_table(simulator.tables, simulator.key_variables,
+                  reachable_states(simulator, all_states=args.all_states),
+                  simulator.model_dir, simulator.artifact_files)
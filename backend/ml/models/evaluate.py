@@ -1,103 +1,186 @@
 import numpy as np
-from sklearn.metrics import mean_squared_error, r2_score
 from sklearn.model_selection import KFold
 import json
+import os
 import pandas as pd
-from inference import EnvironmentSimulator
+from concurrent.futures import ProcessPoolExecutor
+from inference import EnvironmentSimulator, ImpactQuery
+from family_counts import FamilyCounts, bdeu_values, count_families, subtract_family_counts
+from sparse_cpd import densify, sparse_cpd_from_counts
+from sensitivity import morris, noise_propagation, sobol
+from merged_data import merged_data_path, read_merged_data
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+# Set in each worker process by _init_fold_worker
+_fold_context = None
+
+
+def _init_fold_worker(context):
+    global _fold_context
+    _fold_context = context
+
+
+def fit_fold_tables(families, state_names, equivalent_sample_size=10):
+    """BDeu CPD tables (dense, or sparse for high fan-in nodes) from a fold's family counts"""
+    tables = {}
+    for node, family in families.items():
+        parents = family['parents']
+        if 'keys' in family:
+            tables[node] = sparse_cpd_from_counts(node, parents, state_names, family['keys'],
+                                                  family['counts'], equivalent_sample_size)
+        else:
+            tables[node] = {
+                'values': bdeu_values(family['counts'], equivalent_sample_size),
+                'variables': [node] + list(parents),
+                'states': {var: state_names[var] for var in [node] + list(parents)}
+            }
+    return tables
+
+
+def _variable_elimination(tables, impacts):
+    """Per-impact pgmpy queries for folds whose network ImpactQuery cannot answer"""
+    from pgmpy.models import BayesianNetwork
+    from pgmpy.factors.discrete import TabularCPD
+    from pgmpy.inference import VariableElimination
+    
+    model = BayesianNetwork([(parent, node) for node, table in tables.items() for parent in table['variables'][1:]])
+    model.add_nodes_from(tables)
+    for node, table in tables.items():
+        values = densify(table)
+        parents = list(table['variables'][1:])
+        model.add_cpds(TabularCPD(
+            node, values.shape[0], values.reshape(values.shape[0], -1),
+            evidence=parents or None,
+            evidence_card=list(values.shape[1:]) or None,
+            state_names={var: list(table['states'][var]) for var in [node] + parents}
+        ))
+    inference = VariableElimination(model)
+    return lambda evidence: {var: inference.query([var], evidence=evidence, show_progress=False).values
+                             for var in impacts}
+
+
+def _evaluate_fold(args):
+    """Retrain on the training rows, then predict every test row from the pressures.
+
+    The training counts are the full dataset's counts minus the test fold's,
+    so each fold only counts its own test rows.
+    """
+    fold, train_idx, test_idx = args
+    context = _fold_context
+    test_counts = FamilyCounts(context['states'].iloc[test_idx], context['state_names'])
+    families = subtract_family_counts(context['family_counts'], test_counts)
+    tables = fit_fold_tables(families, context['state_names'], context['equivalent_sample_size'])
+    if context['joint_query']:
+        query = ImpactQuery(tables, context['impacts']).query
+    else:
+        query = _variable_elimination(tables, context['impacts'])
+    
+    # One inference per distinct pressure combination, scattered back to the rows
+    evidence = context['states'][context['pressures']].to_numpy()[test_idx]
+    unique_evidence, inverse = np.unique(evidence, axis=0, return_inverse=True)
+    predicted = np.empty((len(unique_evidence), len(context['impacts'])))
+    for row, combination in enumerate(unique_evidence):
+        marginals = query(dict(zip(context['pressures'], combination)))
+        for col, var in enumerate(context['impacts']):
+            predicted[row, col] = context['centers'][var][int(np.argmax(marginals[var]))]
+    predicted = predicted[np.asarray(inverse).ravel()]
+    
+    actual = context['actual'][test_idx]
+    squared_errors = (predicted - actual) ** 2
+    total = ((actual - actual.mean(axis=0)) ** 2).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2 = 1 - squared_errors.sum(axis=0) / total
+    return fold, {
+        'n_test': int(len(test_idx)),
+        'mse': dict(zip(context['impacts'], squared_errors.mean(axis=0).tolist())),
+        'r2': dict(zip(context['impacts'], np.where(total > 0, r2, np.nan).tolist()))
+    }
+
+
 class ModelEvaluator:
     def __init__(self, simulator: EnvironmentSimulator):
         self.simulator = simulator
-        self.data = pd.read_csv('../merged_california_data.csv')
+        variables = [var for category in simulator.key_variables.values() for var in category]
+        self.data = read_merged_data(merged_data_path('..'), columns=variables)
+    
+    def _discretized_rows(self):
+        """Raw values and model states of the rows where every key variable is present"""
+        key_variables = self.simulator.key_variables
+        variables = [var for category in key_variables.values() for var in category]
+        raw = self.data[variables].apply(pd.to_numeric, errors='coerce').dropna()
+        states = self.simulator.discretize_batch(raw).astype(float)
         
-    def evaluate_predictive_accuracy(self, k_folds=5):
-        """Evaluate model's predictive accuracy using k-fold cross validation"""
+        # Keep rows whose bins all exist as states of the model
+        known = np.ones(len(states), dtype=bool)
+        for var in variables:
+            known &= states[var].isin(self.simulator.tables[var]['states'][var]).to_numpy()
+        return raw[known], states[known].reset_index(drop=True)
+        
+    def evaluate_predictive_accuracy(self, k_folds=5, equivalent_sample_size=10, sparse_min_parents=6, n_jobs=None):
+        """Evaluate model's predictive accuracy using k-fold cross validation.
+
+        Each fold refits the network structure of the live model on its
+        training rows (from vectorized family counts) and predicts the impacts
+        of its test rows from their observed pressures. Folds run in parallel.
+        """
         print("[INFO] Evaluating predictive accuracy...")
         
         # Get pressure and impact variables
         pressure_vars = self.simulator.key_variables['environmental_pressure']
         impact_vars = self.simulator.key_variables['impact']
         
-        results = {
-            'mse': [],
-            'r2': [],
-            'fold_predictions': []
+        raw, states = self._discretized_rows()
+        if len(states) < k_folds:
+            print("[WARNING] Not enough complete rows for cross validation")
+            return None
+        
+        tables = self.simulator.tables
+        # Count every family over all rows once; folds subtract their test rows
+        state_names = {var: list(tables[var]['states'][var]) for var in tables}
+        families = {var: (list(table['variables'][1:]), len(table['variables']) - 1 >= sparse_min_parents)
+                    for var, table in tables.items()}
+        context = {
+            'states': states,
+            'state_names': state_names,
+            'family_counts': count_families(FamilyCounts(states, state_names), families, n_jobs=1),
+            'joint_query': ImpactQuery.supports(tables, impact_vars),
+            'equivalent_sample_size': equivalent_sample_size,
+            'pressures': pressure_vars,
+            'impacts': impact_vars,
+            'actual': raw[impact_vars].to_numpy(dtype=float),
+            'centers': {var: np.asarray(self.simulator._continuous_values(var, tables[var]['states'][var]),
+                                        dtype=float) for var in impact_vars}
         }
         
         kf = KFold(n_splits=k_folds, shuffle=True, random_state=42)
+        jobs = [(fold, train_idx, test_idx) for fold, (train_idx, test_idx) in enumerate(kf.split(states))]
         
-        for fold, (train_idx, test_idx) in enumerate(kf.split(self.data)):
-            print(f"\nFold {fold + 1}/{k_folds}")
-            
-            # Train model on training data
-            train_data = self.data.iloc[train_idx]
-            test_data = self.data.iloc[test_idx]
-            
-            # Make predictions
-            fold_predictions = []
-            for idx in test_idx:
-                try:
-                    # Get actual changes in pressure variables
-                    changes = {var: float(self.data.iloc[idx][var]) for var in pressure_vars}
-                    
-                    # Skip if any pressure variables are missing
-                    if any(np.isnan(val) for val in changes.values()):
-                        continue
-                    
-                    # Predict impacts
-                    predicted_impacts = self.simulator.simulate_changes(changes)
-                    actual_impacts = {var: float(self.data.iloc[idx][var]) for var in impact_vars}
-                    
-                    # Skip if any actual impacts are missing
-                    if any(np.isnan(val) for val in actual_impacts.values()):
-                        continue
-                    
-                    fold_predictions.append({
-                        'predicted': predicted_impacts,
-                        'actual': actual_impacts
-                    })
-                except Exception as e:
-                    print(f"[WARNING] Skipping sample due to error: {str(e)}")
-                    continue
-            
-            if not fold_predictions:
-                print("[WARNING] No valid predictions in this fold")
-                continue
-            
-            # Calculate metrics
-            try:
-                mse = np.mean([
-                    mean_squared_error(
-                        list(pred['actual'].values()),
-                        list(pred['predicted'].values())
-                    )
-                    for pred in fold_predictions
-                ])
-                
-                r2 = np.mean([
-                    r2_score(
-                        list(pred['actual'].values()),
-                        list(pred['predicted'].values())
-                    )
-                    for pred in fold_predictions
-                ])
-                
-                results['mse'].append(mse)
-                results['r2'].append(r2)
-                results['fold_predictions'].append(fold_predictions)
-                
-                print(f"MSE: {mse:.4f}")
-                print(f"R2 Score: {r2:.4f}")
-                print(f"Valid predictions: {len(fold_predictions)}")
-            except Exception as e:
-                print(f"[WARNING] Could not calculate metrics for fold: {str(e)}")
-                continue
+        n_jobs = min(n_jobs or os.cpu_count() or 1, k_folds)
+        if n_jobs == 1:
+            _init_fold_worker(context)
+            fold_results = [_evaluate_fold(job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_fold_worker,
+                                     initargs=(context,)) as pool:
+                fold_results = list(pool.map(_evaluate_fold, jobs))
         
-        if not results['mse']:
-            print("[WARNING] No valid results across any folds")
-            return None
+        results = {
+            'mse': [],
+            'r2': [],
+            'folds': []
+        }
+        for fold, metrics in sorted(fold_results, key=lambda item: item[0]):
+            mse = float(np.mean(list(metrics['mse'].values())))
+            r2 = float(np.nanmean(list(metrics['r2'].values())))
+            results['mse'].append(mse)
+            results['r2'].append(r2)
+            results['folds'].append(metrics)
+            
+            print(f"\nFold {fold + 1}/{k_folds}")
+            print(f"MSE: {mse:.4f}")
+            print(f"R2 Score: {r2:.4f}")
+            print(f"Test rows: {metrics['n_test']}")
         
         return results
     
@@ -161,30 +244,25 @@ class ModelEvaluator:
         
         uncertainty_results = []
         for scenario in scenarios:
-            # Make multiple predictions with small variations
-            predictions = []
-            for _ in range(100):
-                # Add small random noise to inputs
-                noisy_scenario = {
-                    k: v + np.random.normal(0, 2) 
-                    for k, v in scenario.items()
-                }
-                impacts = self.simulator.simulate_changes(noisy_scenario)
-                predictions.append(impacts)
-            
-            # Calculate variance of predictions
-            variances = {
-                var: np.var([pred[var] for pred in predictions])
-                for var in predictions[0].keys()
-            }
+            # Exact spread under N(0, 2) input noise instead of 100 noisy simulations
+            propagated = noise_propagation(self.simulator, scenario, sigma=2.0)
             
             uncertainty_results.append({
                 'scenario': scenario,
-                'prediction_variance': variances
+                'prediction_mean': propagated['mean'],
+                'prediction_variance': propagated['variance']
             })
         
         return uncertainty_results
     
+    def evaluate_global_sensitivity(self, samples=512):
+        """Morris screening and Sobol indices of all pressure/state inputs on every impact"""
+        print("\n[INFO] Evaluating global sensitivity...")
+        return {
+            'morris': morris(self.simulator, seed=42),
+            'sobol': sobol(self.simulator, samples=samples, seed=42)
+        }
+    
     def evaluate_semantic_reliability(self, test_prompts):
         """Evaluate consistency of LLM interpretations"""
         print("\n[INFO] Evaluating semantic reliability...")
@@ -250,6 +328,7 @@ if __name__ == "__main__":
     predictive_results = evaluator.evaluate_predictive_accuracy()
     causal_results = evaluator.evaluate_causal_consistency()
     uncertainty_results = evaluator.evaluate_uncertainty()
+    sensitivity_results = evaluator.evaluate_global_sensitivity()
     semantic_results = evaluator.evaluate_semantic_reliability(test_prompts)
     
     # Save results
@@ -257,6 +336,7 @@ if __name__ == "__main__":
         'predictive': predictive_results,
         'causal': causal_results,
         'uncertainty': uncertainty_results,
+        'sensitivity': sensitivity_results,
         'semantic': semantic_results
     }
     
@@ -0,0 +1,216 @@
+import json
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from artifact_bundle import to_json_value
+
+COUNTS_FILE = 'family_counts.npz'
+
+# Set in each worker process by _init_worker
+_counts = None
+
+
+class FamilyCounts:
+    """Sufficient statistics of a discretized dataset, cached per (node, parents) family.
+
+    Every column is integer-encoded once against its sorted state names, so a
+    family's counts are a single np.bincount (dense) or np.unique (sparse)
+    over mixed-radix keys instead of a pandas groupby over the DataFrame.
+    """
+
+    def __init__(self, data, state_names=None):
+        self.variables = list(data.columns)
+        self.state_names = state_names or {var: sorted(data[var].dropna().unique()) for var in self.variables}
+        self.cards = {var: len(self.state_names[var]) for var in self.variables}
+        self.codes = {
+            var: np.searchsorted(np.asarray(self.state_names[var]), data[var].to_numpy()).astype(np.int64)
+            for var in self.variables
+        }
+        self.n = len(data)
+        self._cache = {}
+
+    def parent_keys(self, parents):
+        """Mixed-radix key of every row's parent configuration"""
+        if not parents:
+            return np.zeros(self.n, dtype=np.int64)
+        return np.ravel_multi_index([self.codes[p] for p in parents], [self.cards[p] for p in parents])
+
+    def sparse_counts(self, node, parents):
+        """(keys, counts) of the parent configurations present in the data.
+
+        counts has one row per observed parent configuration and one column per
+        state of node. Results are cached, so rescoring a family is free.
+        """
+        key = (node, tuple(parents))
+        if key not in self._cache:
+            keys, index = np.unique(self.parent_keys(parents), return_inverse=True)
+            counts = np.zeros((len(keys), self.cards[node]))
+            np.add.at(counts, (np.asarray(index).ravel(), self.codes[node]), 1)
+            self._cache[key] = (keys, counts)
+        return self._cache[key]
+
+    def dense_counts(self, node, parents):
+        """Counts shaped [node, *parents] (the CPD axis order) from a single np.bincount"""
+        key = ('dense', node, tuple(parents))
+        if key not in self._cache:
+            q = self.n_configurations(parents)
+            flat = np.bincount(self.codes[node] * q + self.parent_keys(parents),
+                               minlength=self.cards[node] * q)
+            shape = [self.cards[node]] + [self.cards[p] for p in parents]
+            self._cache[key] = flat.astype(np.int32).reshape(shape)
+        return self._cache[key]
+
+    def n_configurations(self, parents):
+        return int(np.prod([self.cards[p] for p in parents], dtype=np.int64))
+
+
+def _init_worker(counts):
+    global _counts
+    _counts = counts
+
+
+def _count_family(args):
+    node, parents, sparse = args
+    if sparse:
+        keys, counts = _counts.sparse_counts(node, parents)
+        return node, {'parents': parents, 'keys': keys, 'counts': counts.astype(np.int32)}
+    return node, {'parents': parents, 'counts': _counts.dense_counts(node, parents)}
+
+
+def count_families(counts, families, n_jobs=None):
+    """Count every family in a process pool.
+
+    families maps node -> (parents, sparse). Returns node -> {'parents',
+    'counts'} with dense [node, *parents] counts, or {'parents', 'keys',
+    'counts'} holding only the observed parent configurations when sparse.
+    """
+    jobs = [(node, list(parents), sparse) for node, (parents, sparse) in families.items()]
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1 or len(jobs) == 1:
+        _init_worker(counts)
+        return dict(_count_family(job) for job in jobs)
+    with ProcessPoolExecutor(max_workers=min(n_jobs, len(jobs)), initializer=_init_worker,
+                             initargs=(counts,)) as pool:
+        return dict(pool.map(_count_family, jobs))
+
+
+def bdeu_values(counts, equivalent_sample_size=10, columns=None):
+    """BDeu posterior CPD values from dense [node, *parents] counts.
+
+    With columns (flattened parent configuration indices) only those columns
+    are computed and returned as a [node, len(columns)] array.
+    """
+    r = counts.shape[0]
+    alpha = float(equivalent_sample_size) / counts.size
+    flat = counts.reshape(r, -1)
+    if columns is not None:
+        flat = flat[:, columns] + alpha
+        return flat / flat.sum(axis=0)
+    flat = flat + alpha
+    return (flat / flat.sum(axis=0)).reshape(counts.shape)
+
+
+def encode_rows(data, state_names):
+    """Integer-encode discretized rows against known state names; unseen states raise ValueError"""
+    codes = {}
+    for var, states in state_names.items():
+        states = np.asarray(states)
+        values = data[var].to_numpy()
+        index = np.clip(np.searchsorted(states, values), 0, len(states) - 1)
+        unknown = states[index] != values
+        if unknown.any():
+            raise ValueError(f"{var} has states unseen in training: {sorted(set(values[unknown].tolist()))}")
+        codes[var] = index.astype(np.int64)
+    return codes
+
+
+def update_family_counts(families, state_names, data):
+    """Add a batch of discretized rows to the family counts in place.
+
+    Costs O(rows) per family: only the cells of the new rows are incremented,
+    and sparse families insert the parent configurations they had not seen.
+    Returns node -> parent configuration keys touched by the batch (indices
+    into the flattened parent axes for dense counts, rows for sparse ones).
+    """
+    codes = encode_rows(data, state_names)
+    touched = {}
+    for node, family in families.items():
+        parents = family['parents']
+        cards = [len(state_names[p]) for p in parents]
+        keys = (np.ravel_multi_index([codes[p] for p in parents], cards) if parents
+                else np.zeros(len(data), dtype=np.int64))
+
+        if 'keys' not in family:
+            counts = family['counts'].reshape(family['counts'].shape[0], -1)
+            np.add.at(counts, (codes[node], keys), 1)
+            touched[node] = np.unique(keys)
+            continue
+
+        # Merge newly seen parent configurations into the sorted key array
+        new_keys = np.setdiff1d(keys, family['keys'])
+        if len(new_keys):
+            merged = np.union1d(family['keys'], new_keys)
+            counts = np.zeros((len(merged), family['counts'].shape[1]), dtype=family['counts'].dtype)
+            counts[np.searchsorted(merged, family['keys'])] = family['counts']
+            family['keys'], family['counts'] = merged, counts
+        rows = np.searchsorted(family['keys'], keys)
+        np.add.at(family['counts'], (rows, codes[node]), 1)
+        touched[node] = np.unique(rows)
+    return touched
+
+
+def subtract_family_counts(families, counts):
+    """Family counts with the rows of counts (a FamilyCounts over the same states) taken out.
+
+    Returns new families in the count_families layout, leaving families
+    untouched. Sparse families drop the parent configurations left without
+    rows, so they stay exactly what counting the remaining rows would give.
+    """
+    remaining = {}
+    for node, family in families.items():
+        parents = family['parents']
+        if 'keys' not in family:
+            remaining[node] = {'parents': parents,
+                               'counts': family['counts'] - counts.dense_counts(node, parents)}
+            continue
+
+        keys, removed = counts.sparse_counts(node, parents)
+        rows = np.searchsorted(family['keys'], keys)
+        left = family['counts'].astype(np.int64)
+        left[rows] -= removed.astype(np.int64)
+        present = left.sum(axis=1) > 0
+        remaining[node] = {'parents': parents, 'keys': family['keys'][present],
+                           'counts': left[present].astype(family['counts'].dtype)}
+    return remaining
+
+
+def save_family_counts(path, families, state_names, equivalent_sample_size=10):
+    """Persist family counts (plus the state names they index) as a single .npz"""
+    arrays = {}
+    meta = {'state_names': {var: [to_json_value(s) for s in states] for var, states in state_names.items()},
+            'equivalent_sample_size': equivalent_sample_size,
+            'families': {}}
+    for idx, (node, family) in enumerate(families.items()):
+        arrays[f'{idx}_counts'] = family['counts']
+        info = {'index': idx, 'parents': family['parents'], 'sparse': 'keys' in family}
+        if info['sparse']:
+            arrays[f'{idx}_keys'] = family['keys']
+        meta['families'][node] = info
+    # Write next to the target and rename, so a crash never leaves half a file
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp_path, path)
+    print(f"[INFO] Saved counts for {len(families)} families to {path}")
+
+
+def load_family_counts(path):
+    """Return (families, state_names, equivalent_sample_size) saved by save_family_counts"""
+    with np.load(path, allow_pickle=False) as archive:
+        meta = json.loads(str(archive['meta']))
+        families = {}
+        for node, info in meta['families'].items():
+            family = {'parents': info['parents'], 'counts': archive[f"{info['index']}_counts"]}
+            if info['sparse']:
+                family['keys'] = archive[f"{info['index']}_keys"]
+            families[node] = family
+    return families, meta['state_names'], meta.get('equivalent_sample_size', 10)
@@ -1,49 +1,435 @@
 import json
+import os
 import pickle
-from pgmpy.models import BayesianNetwork
-from pgmpy.inference import VariableElimination
 import numpy as np
+import pandas as pd
+import threading
+from collections import OrderedDict
+
+try:
+    from .compile_table import CompiledTable
+    from .artifact_bundle import BUNDLE_DIR, MANIFEST_FILE, cpd_tables, export_discretizers, load_bundle
+    from .sparse_cpd import SPARSE_FILE, densify, is_sparse, parent_codes, sparse_marginal
+    from .sampling import LikelihoodWeightingSampler, weighted_quantiles
+    from .merged_data import merged_columns, merged_data_path, read_merged_data
+except ImportError:
+    from compile_table import CompiledTable
+    from artifact_bundle import BUNDLE_DIR, MANIFEST_FILE, cpd_tables, export_discretizers, load_bundle
+    from sparse_cpd import SPARSE_FILE, densify, is_sparse, parent_codes, sparse_marginal
+    from sampling import LikelihoodWeightingSampler, weighted_quantiles
+    from merged_data import merged_columns, merged_data_path, read_merged_data
+
+# Artifacts are resolved relative to this module unless ECOSIM_MODEL_DIR is set
+MODEL_DIR = os.getenv('ECOSIM_MODEL_DIR', os.path.dirname(os.path.abspath(__file__)))
+
+# Default sample budget of simulate_sampled; latency grows linearly with it
+SAMPLE_BUDGET = int(os.getenv('ECOSIM_SAMPLE_BUDGET', '5000'))
+
+# Observed county data behind simulate_counties. Defaults to the merged dataset next to this
+# package (backend/ml), not next to the model directory, which may be a shared-memory copy
+COUNTY_DATA = os.getenv('ECOSIM_COUNTY_DATA')
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+COUNTY_KEY = 'County No.'
+
+# Shared copy of the model directory, set by shared_model.publish_bundle in the master
+# process and inherited by forked workers
+SHARED_DIR_ENV = 'ECOSIM_SHARED_DIR'
+
+
+class ImpactQuery:
+    """Posterior of every impact variable from a single elimination pass.
+
+    Impact nodes are leaves of the network, so each impact marginal is
+    sum_u P(u, e) * P(impact | u, e) over the same unobserved pressure/state
+    ancestors u. The shared factor P(u, e) is eliminated once per evidence set
+    and reused by all impacts instead of running one VariableElimination each.
+    Sparse impact CPDs (see sparse_cpd.py) are queried without densifying.
+    """
+
+    def __init__(self, tables, targets, factor_cache_size=4):
+        self.targets = list(targets)
+        # Only leaf targets benefit from staying sparse; ancestors take part in the einsum
+        self.tables = {
+            var: dict(table, type='tabular', values=densify(table))
+            if is_sparse(table) and var not in self.targets else table
+            for var, table in tables.items()
+        }
+        self.sparse_codes = {var: parent_codes(table) for var, table in self.tables.items() if is_sparse(table)}
+        self.ancestors = [var for var in tables if var not in self.targets]
+        self.states = {var: table['states'][var] for var, table in tables.items()}
+        self.axis_ids = {var: idx for idx, var in enumerate(tables)}
+        self.factor_cache_size = factor_cache_size
+        self._factor_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def supports(tables, targets):
+        """The shared-ancestor elimination only holds when every target is a leaf"""
+        parents = {parent for table in tables.values() for parent in table['variables'][1:]}
+        return not parents.intersection(targets)
+
+    def _state_index(self, var, state):
+        try:
+            return self.states[var].index(state)
+        except ValueError:
+            raise ValueError(f"State {state} is not a known state of {var}")
+
+    def _reduce(self, var, evidence):
+        """Slice a CPD on the observed variables, returning its values and free axis ids"""
+        table = self.tables[var]
+        index = tuple(
+            self._state_index(v, evidence[v]) if v in evidence else slice(None)
+            for v in table['variables']
+        )
+        free = [self.axis_ids[v] for v in table['variables'] if v not in evidence]
+        if is_sparse(table):
+            return self._sparse_likelihood(var, evidence), free
+        return table['values'][index], free
+
+    def _sparse_split(self, var, evidence):
+        """Positions of a sparse CPD's free parents and the observed parent state indices"""
+        parents = self.tables[var]['variables'][1:]
+        free_parents = [pos for pos, parent in enumerate(parents) if parent not in evidence]
+        observed = {pos: self._state_index(parent, evidence[parent])
+                    for pos, parent in enumerate(parents) if parent in evidence}
+        return free_parents, observed
+
+    def _sparse_likelihood(self, var, evidence):
+        """P(var = observed | free parents) of a sparse CPD as a dense array over the free parents"""
+        table = self.tables[var]
+        codes = self.sparse_codes[var]
+        free_parents, observed = self._sparse_split(var, evidence)
+        state = self._state_index(var, evidence[var])
+        
+        mask = np.ones(len(codes), dtype=bool)
+        for position, observed_state in observed.items():
+            mask &= codes[:, position] == observed_state
+        if not free_parents:
+            # Every parent is observed: one stored row at most, else the default row
+            return np.asarray(table['rows'][mask, state][0] if mask.any() else table['default'][state])
+        
+        shape = [table['cards'][pos + 1] for pos in free_parents]
+        values = np.full(shape, table['default'][state])
+        values[tuple(codes[mask][:, free_parents].T)] = table['rows'][mask, state]
+        return values
+
+    def shared_factor(self, evidence):
+        """Unnormalized P(u, e) over the unobserved ancestors, cached per evidence set"""
+        key = frozenset(evidence.items())
+        with self._lock:
+            if key in self._factor_cache:
+                self._factor_cache.move_to_end(key)
+                return self._factor_cache[key]
+        
+        operands = []
+        # Observed impacts only contribute their likelihood to the ancestors
+        for var in self.ancestors + [t for t in self.targets if t in evidence]:
+            values, free = self._reduce(var, evidence)
+            operands += [values, free]
+        free_ancestors = [self.axis_ids[v] for v in self.ancestors if v not in evidence]
+        factor = np.einsum(*operands, free_ancestors, optimize='greedy')
+        
+        with self._lock:
+            self._factor_cache[key] = (factor, free_ancestors)
+            if len(self._factor_cache) > self.factor_cache_size:
+                self._factor_cache.popitem(last=False)
+        return factor, free_ancestors
+
+    def query(self, evidence):
+        """Return {impact: normalized marginal} for every unobserved impact variable"""
+        factor, free_ancestors = self.shared_factor(evidence)
+        marginals = {}
+        for target in self.targets:
+            if target in evidence:
+                continue
+            if is_sparse(self.tables[target]):
+                marginals[target] = self._sparse_query(target, evidence, factor, free_ancestors)
+                continue
+            values, free = self._reduce(target, evidence)
+            marginal = np.einsum(factor, free_ancestors, values, free,
+                                 [self.axis_ids[target]], optimize='greedy')
+            marginals[target] = marginal / marginal.sum()
+        return marginals
+
+    def _sparse_query(self, target, evidence, factor, free_ancestors):
+        """Marginal of a sparse target from the shared factor projected onto its free parents"""
+        table = self.tables[target]
+        free_parents, observed = self._sparse_split(target, evidence)
+        parents = table['variables'][1:]
+        weights = np.einsum(factor, free_ancestors,
+                            [self.axis_ids[parents[pos]] for pos in free_parents], optimize='greedy')
+        marginal = sparse_marginal(table, self.sparse_codes[target], weights, free_parents, observed)
+        return marginal / marginal.sum()
+
+
+class EvidenceCache:
+    """Bounded LRU cache of impact marginals keyed on the discretized evidence"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(evidence):
+        return tuple(sorted(evidence.items()))
+
+    def get(self, evidence):
+        key = self.key(evidence)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, evidence, value):
+        if self.maxsize <= 0:
+            return
+        key = self.key(evidence)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all entries and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
 
 class EnvironmentSimulator:
-    def __init__(self):
+    def __init__(self, model_dir=None, cache_size=1024, use_bundle=True):
         """Load the trained model and preprocessing artifacts"""
+        self.model_dir = model_dir or MODEL_DIR
+        self.use_bundle = use_bundle
+        shared_dir = os.getenv(SHARED_DIR_ENV)
+        self.shared = bool(shared_dir) and os.path.abspath(self.model_dir) == os.path.abspath(shared_dir)
+        self.cache = EvidenceCache(cache_size)
+        self._county_lock = threading.Lock()
+        self._load_artifacts()
+    
+    def _path(self, name):
+        return os.path.join(self.model_dir, name)
+    
+    def _load_artifacts(self):
+        bundle_dir = self._path(BUNDLE_DIR)
+        if self.use_bundle and os.path.exists(os.path.join(bundle_dir, MANIFEST_FILE)):
+            # Fast start: memory-mapped CPD arrays, no pickle/pgmpy/sklearn needed
+            self.tables, self.bins, self.key_variables, _ = load_bundle(bundle_dir)
+            self.model = None
+            self.discretizers = None
+            self.inference = None
+            self.artifact_files = [os.path.join(BUNDLE_DIR, MANIFEST_FILE)]
+        else:
+            self._load_pickles()
+        
+        self.impact_query = None
+        if ImpactQuery.supports(self.tables, self.key_variables['impact']):
+            self.impact_query = ImpactQuery(self.tables, self.key_variables['impact'])
+        
+        # Precompiled marginals (see compile_table.py) answer without running inference
+        self.compiled_table = CompiledTable.load(self.model_dir, self.artifact_files)
+        self.sampler = LikelihoodWeightingSampler(self.tables)
+        
+        # County baselines are read on the first simulate_counties call (see _county_data)
+        with self._county_lock:
+            self._counties = None
+    
+    def _load_pickles(self):
+        from pgmpy.inference import VariableElimination
+        
         # Load model and artifacts
-        with open('bayesian_network.pkl', 'rb') as f:
+        with open(self._path('bayesian_network.pkl'), 'rb') as f:
             self.model = pickle.load(f)
         
-        with open('discretizers.pkl', 'rb') as f:
+        with open(self._path('discretizers.pkl'), 'rb') as f:
             self.discretizers = pickle.load(f)
             
-        with open('key_variables.json', 'r') as f:
+        with open(self._path('key_variables.json'), 'r') as f:
             self.key_variables = json.load(f)
+        
+        self.tables = cpd_tables(self.model)
+        self.bins = export_discretizers(self.discretizers)
+        self.artifact_files = ['bayesian_network.pkl', 'discretizers.pkl']
+        
+        # High fan-in nodes trained with cpd_backend='sparse' are kept outside the pgmpy model
+        sparse_path = self._path(SPARSE_FILE)
+        if os.path.exists(sparse_path):
+            with open(sparse_path, 'rb') as f:
+                self.tables.update(pickle.load(f))
+            self.artifact_files.append(SPARSE_FILE)
             
-        # Initialize inference engine
-        self.inference = VariableElimination(self.model)
+        # Initialize inference engine (pgmpy needs a CPD for every node)
+        if len(self.tables) == len(self.model.get_cpds()):
+            self.inference = VariableElimination(self.model)
+        else:
+            self.inference = None
+    
+    def _county_data(self):
+        """(baselines, states) of every county, loaded once and shared by all threads"""
+        with self._county_lock:
+            if self._counties is None:
+                self._counties = self._load_county_baselines()
+            return self._counties
+    
+    def _load_county_baselines(self):
+        """Index each county's observed pressure/state values and their model states by County No."""
+        path = COUNTY_DATA or merged_data_path(DATA_DIR)
+        if not os.path.exists(path):
+            raise ValueError(f"No county data at {path}; set ECOSIM_COUNTY_DATA")
+        
+        variables = [var for var in self.key_variables['environmental_pressure'] +
+                     self.key_variables['environmental_state'] if var in self.bins]
+        columns = set(merged_columns(path))
+        data = read_merged_data(path, columns=[COUNTY_KEY] + [var for var in variables if var in columns])
+        data = data[data[COUNTY_KEY].notna()]
+        baselines = (data.reindex(columns=[COUNTY_KEY] + variables)
+                     .apply(pd.to_numeric, errors='coerce')
+                     .groupby(data[COUNTY_KEY].astype(int)).mean()
+                     .drop(columns=COUNTY_KEY))
+        baselines.index.name = COUNTY_KEY
+        
+        # Bins never seen in training are not states of the network, so they are left as no evidence
+        states = self.discretize_batch(baselines)
+        for var in states.columns:
+            known = states[var].isin(self.tables[var]['states'][var])
+            states[var] = states[var].where(known, -1)
+        return baselines, states
+    
+    def reload(self):
+        """Reload the model artifacts from disk and invalidate cached results.
+
+        A simulator on a shared copy republishes from the source model
+        directory first: the copy itself never changes, and publishing a newer
+        one deletes it.
+        """
+        if self.shared:
+            try:
+                from .shared_model import publish_bundle
+            except ImportError:
+                from shared_model import publish_bundle
+            self.model_dir = publish_bundle()
+        self._load_artifacts()
+        self.cache.clear()
         
     def _discretize_input(self, variable, value):
         """Convert continuous input to discrete states with enhanced preprocessing"""
-        discretizer = self.discretizers[variable]
-        if isinstance(discretizer, dict):
-            if 'type' in discretizer:  # Categorical variable
-                return discretizer['mapping'].get(value, 0)
-            else:  # Numeric variable with enhanced preprocessing
-                # Apply the same preprocessing as during training
-                scaled_value = discretizer['scaler'].transform([[value]])[0][0]
-                return int(discretizer['discretizer'].transform([[scaled_value]])[0])
-        return 0  # Default case
+        if variable not in self.bins:
+            return 0  # Default case
+        return int(self._discretize_values(variable, np.array([value]))[0])
     
     def _continuous_output(self, variable, state):
         """Convert discrete states back to continuous values with inverse preprocessing"""
-        discretizer = self.discretizers[variable]
-        if isinstance(discretizer, dict):
-            if 'type' in discretizer:  # Categorical variable
-                reverse_map = {v: k for k, v in discretizer['mapping'].items()}
-                return reverse_map.get(state, "UNKNOWN")
-            else:  # Numeric variable with enhanced preprocessing
-                # Inverse transform through both discretizer and scaler
-                continuous_scaled = discretizer['discretizer'].inverse_transform([[state]])[0][0]
-                return float(discretizer['scaler'].inverse_transform([[continuous_scaled]])[0])
-        return 0  # Default case
+        if variable not in self.bins:
+            return 0  # Default case
+        return self._continuous_values(variable, np.array([state]))[0]
+
+    def _discretize_values(self, variable, values):
+        """Discretize an array of raw values for one variable"""
+        params = self.bins[variable]
+        if params['type'] == 'categorical':
+            return pd.Series(values).map(params['mapping']).fillna(0).to_numpy(dtype=np.int64)
+        scaled = (np.asarray(values, dtype=float) - params['center']) / params['scale']
+        return np.searchsorted(params['inner_edges'], scaled, side='right').astype(np.int64)
+
+    def _continuous_values(self, variable, states):
+        """Map an array of discrete states back to continuous values"""
+        params = self.bins[variable]
+        if params['type'] == 'categorical':
+            return [params['reverse'].get(state, "UNKNOWN") for state in states]
+        states = np.clip(np.asarray(states, dtype=np.int64), 0, len(params['bin_centers']) - 1)
+        return (params['bin_centers'][states] * params['scale'] + params['center']).tolist()
+
+    def discretize_batch(self, data):
+        """Discretize every known column of a DataFrame in one vectorized pass.
+
+        Missing values become -1, i.e. "no evidence" for that variable.
+        """
+        states = {}
+        for var in data.columns:
+            if var not in self.bins:
+                continue
+            column = data[var]
+            missing = column.isna().to_numpy()
+            discrete = np.full(len(column), -1, dtype=np.int64)
+            if not missing.all():
+                discrete[~missing] = self._discretize_values(var, column.to_numpy()[~missing])
+            states[var] = discrete
+        return pd.DataFrame(states, index=data.index)
+
+    def continuous_batch(self, states):
+        """Convert a DataFrame (or dict of arrays) of discrete states to continuous values.
+
+        States of -1 map to NaN.
+        """
+        states = pd.DataFrame(states)
+        values = {}
+        for var in states.columns:
+            if var not in self.bins:
+                continue
+            column = states[var].to_numpy()
+            observed = column >= 0
+            converted = np.full(len(column), np.nan, dtype=object if self.bins[var]['type'] == 'categorical' else float)
+            if observed.any():
+                converted[observed] = self._continuous_values(var, column[observed])
+            values[var] = converted
+        return pd.DataFrame(values, index=states.index)
+
+    def _query_impacts(self, evidence):
+        """Return {impact: (marginal, state_names)} for all impacts given the evidence"""
+        if self.compiled_table is not None:
+            compiled = self.compiled_table.lookup(evidence)
+            if compiled is not None:
+                return compiled
+        
+        cached = self.cache.get(evidence)
+        if cached is not None:
+            return cached
+        
+        results = self._run_inference(evidence)
+        self.cache.put(evidence, results)
+        return results
+
+    def _run_inference(self, evidence):
+        """Run exact inference for all impacts given the evidence"""
+        if self.impact_query is not None:
+            try:
+                marginals = self.impact_query.query(evidence)
+                return {var: (values, self.impact_query.states[var]) for var, values in marginals.items()}
+            except Exception as e:
+                if self.inference is None:
+                    raise
+                print(f"Warning: Joint impact query failed, falling back to per-variable queries: {str(e)}")
+        
+        if self.inference is None:
+            raise ValueError("No inference engine available for this network")
+        
+        results = {}
+        for impact_var in self.key_variables['impact']:
+            try:
+                prediction = self.inference.query(variables=[impact_var], evidence=evidence, show_progress=False)
+                results[impact_var] = (prediction.values, prediction.state_names[impact_var])
+            except Exception as e:
+                print(f"Warning: Failed to predict {impact_var}: {str(e)}")
+        return results
 
     def process_llm_input(self, text_input):
         """Convert LLM text output to model inputs
@@ -56,48 +442,241 @@ class EnvironmentSimulator:
         }
         return changes
 
-    def simulate_changes(self, changes):
-        """Simulate environmental changes with enhanced error handling"""
-        try:
-            # Convert inputs to discrete states
-            evidence = {}
-            for var, change in changes.items():
-                if var not in self.discretizers:
-                    print(f"Warning: Variable {var} not found in model")
-                    continue
-                    
-                current_value = 50  # Default baseline
-                new_value = current_value + change
-                
-                # Ensure value is within reasonable bounds
-                new_value = max(0, min(100, new_value))  # Clip to 0-100 range
+    def _changes_to_evidence(self, changes, baseline=50):
+        """Convert {variable: change} into discrete evidence around the baseline"""
+        evidence = {}
+        for var, change in changes.items():
+            if var not in self.bins:
+                print(f"Warning: Variable {var} not found in model")
+                continue
                 
-                evidence[var] = self._discretize_input(var, new_value)
+            new_value = baseline + change
             
-            if not evidence:
-                raise ValueError("No valid changes to simulate")
+            # Ensure value is within reasonable bounds
+            new_value = max(0, min(100, new_value))  # Clip to 0-100 range
             
-            # Predict impacts
-            impacts = {}
+            evidence[var] = self._discretize_input(var, new_value)
+        
+        if not evidence:
+            raise ValueError("No valid changes to simulate")
+        return evidence
+
+    def simulate_sampled(self, changes, n_samples=None, quantiles=(0.05, 0.5, 0.95), interval=0.9,
+                         baseline=50):
+        """Approximate impacts with uncertainty from likelihood-weighted sampling.
+
+        Cost is fixed by the sample budget instead of the network size. Returns
+        {impact: {'mean', 'std', 'quantiles', 'interval', 'effective_samples'}}
+        with values in the continuous units of simulate_changes.
+        """
+        try:
+            evidence = self._changes_to_evidence(changes, baseline)
+            indices = {var: self.sampler.states[var].index(state) for var, state in evidence.items()}
+            samples, weights = self.sampler.sample(indices, n_samples or SAMPLE_BUDGET)
+            effective = float(1.0 / np.sum(weights ** 2))
+            tail = (1 - interval) / 2
+            
+            results = {}
             for impact_var in self.key_variables['impact']:
-                try:
-                    prediction = self.inference.query(variables=[impact_var], evidence=evidence)
-                    most_likely_state = np.argmax(prediction.values)
-                    impacts[impact_var] = self._continuous_output(impact_var, most_likely_state)
-                except Exception as e:
-                    print(f"Warning: Failed to predict {impact_var}: {str(e)}")
-                    impacts[impact_var] = None
+                if impact_var in evidence:
+                    continue
+                # Continuous value of every state, then of every sample
+                centers = np.asarray(self._continuous_values(impact_var, self.sampler.states[impact_var]),
+                                     dtype=float)
+                values = centers[samples[impact_var]]
+                mean = float(np.sum(weights * values))
+                low, high = weighted_quantiles(values, weights, [tail, 1 - tail])
+                results[impact_var] = {
+                    'mean': mean,
+                    'std': float(np.sqrt(np.sum(weights * (values - mean) ** 2))),
+                    'quantiles': {str(q): float(v) for q, v in
+                                  zip(quantiles, weighted_quantiles(values, weights, list(quantiles)))},
+                    'interval': [float(low), float(high)],
+                    'effective_samples': effective
+                }
+            return results
+            
+        except Exception as e:
+            print(f"Error in sampled simulation: {str(e)}")
+            return {}
+
+    def simulate_changes(self, changes):
+        """Simulate environmental changes with enhanced error handling"""
+        try:
+            evidence = self._changes_to_evidence(changes)
             
-            return impacts
+            # Predict all impacts from one shared elimination
+            return self._impacts_from_marginals(self._query_impacts(evidence))
             
         except Exception as e:
             print(f"Error in simulation: {str(e)}")
             return {}
 
+    def simulate_distributions(self, changes):
+        """Full posterior of every impact from the same inference as simulate_changes.
+
+        Returns {impact: {'value', 'expected_value', 'distribution', 'entropy',
+        'confidence'}} where value is the simulate_changes (modal) value,
+        expected_value the probability-weighted mean of the bin centers,
+        distribution a list of {'value', 'probability'} per state, entropy is
+        in bits and confidence is 1 - entropy / max entropy.
+        """
+        try:
+            evidence = self._changes_to_evidence(changes)
+            return self._distributions_from_marginals(self._query_impacts(evidence))
+        except Exception as e:
+            print(f"Error in simulation: {str(e)}")
+            return {}
+
+    def _distributions_from_marginals(self, marginals):
+        """Summarize each impact marginal without another inference pass"""
+        results = {}
+        for impact_var in self.key_variables['impact']:
+            if impact_var not in marginals:
+                results[impact_var] = None
+                continue
+            values, states = marginals[impact_var]
+            probabilities = np.asarray(values, dtype=float)
+            centers = self._continuous_values(impact_var, states)
+            numeric = self.bins.get(impact_var, {}).get('type') == 'numeric'
+            
+            nonzero = probabilities[probabilities > 0]
+            entropy = float(-np.sum(nonzero * np.log2(nonzero)))
+            max_entropy = np.log2(len(probabilities)) if len(probabilities) > 1 else 1.0
+            
+            results[impact_var] = {
+                'value': centers[int(np.argmax(probabilities))],
+                'expected_value': float(np.dot(probabilities, centers)) if numeric else None,
+                'distribution': [{'value': center, 'probability': float(p)}
+                                 for center, p in zip(centers, probabilities)],
+                'entropy': entropy,
+                'confidence': float(1 - entropy / max_entropy)
+            }
+        return results
+
+    def _impacts_from_marginals(self, marginals):
+        """Map each impact's most likely state back to a continuous value"""
+        impacts = {}
+        for impact_var in self.key_variables['impact']:
+            if impact_var not in marginals:
+                impacts[impact_var] = None
+                continue
+            values, states = marginals[impact_var]
+            most_likely_state = states[int(np.argmax(values))]
+            impacts[impact_var] = self._continuous_output(impact_var, most_likely_state)
+        return impacts
+
+    def simulate_many(self, changes_df, baseline=50):
+        """Simulate many scenarios at once.
+
+        Each row of changes_df is a scenario and each column a variable change
+        (NaN means the variable is left unchanged). Rows are discretized in one
+        pass, inference runs once per unique evidence combination, and the
+        results are scattered back into an N x impacts DataFrame.
+        """
+        impact_vars = self.key_variables['impact']
+        unknown = [var for var in changes_df.columns if var not in self.bins]
+        if unknown:
+            print(f"Warning: Variables {unknown} not found in model")
+        
+        known = [var for var in changes_df.columns if var in self.bins]
+        if len(changes_df) == 0 or not known:
+            return pd.DataFrame(np.full((len(changes_df), len(impact_vars)), np.nan, dtype=object),
+                                index=changes_df.index, columns=impact_vars)
+        
+        new_values = (baseline + changes_df[known].astype(float)).clip(0, 100)  # Clip to 0-100 range
+        return self._simulate_states(self.discretize_batch(new_values))
+
+    def _simulate_states(self, states):
+        """Impacts for every row of a DataFrame of discrete evidence (-1 = unobserved).
+
+        Inference runs once per unique row and the results are scattered back.
+        """
+        impact_vars = self.key_variables['impact']
+        if len(states) == 0:
+            return pd.DataFrame(columns=impact_vars, index=states.index)
+        
+        unique_states, inverse = np.unique(states.to_numpy(), axis=0, return_inverse=True)
+        unique_results = np.full((len(unique_states), len(impact_vars)), np.nan, dtype=object)
+        for row, combination in enumerate(unique_states):
+            evidence = {var: int(state) for var, state in zip(states.columns, combination) if state >= 0}
+            if not evidence:
+                continue
+            try:
+                impacts = self._impacts_from_marginals(self._query_impacts(evidence))
+                unique_results[row] = [impacts[var] for var in impact_vars]
+            except Exception as e:
+                print(f"Error in simulation: {str(e)}")
+        
+        results = unique_results[np.asarray(inverse).ravel()]
+        return pd.DataFrame(results, index=states.index, columns=impact_vars).infer_objects()
+
+    def simulate_counties(self, changes, counties=None):
+        """Apply the same changes to every county in one batch.
+
+        Each county starts from its observed pressure/state values (see
+        _load_county_baselines), which all enter the network as evidence;
+        a change of c moves the county's own value by c percent. Returns a
+        counties x impacts DataFrame indexed by County No. The county data is
+        read on the first call, so a missing or unreadable file only fails here.
+        """
+        baselines, states = self._county_data()
+        if counties is not None:
+            counties = [int(county) for county in counties]
+            missing = [county for county in counties if county not in baselines.index]
+            if missing:
+                raise ValueError(f"Unknown counties: {missing}")
+            baselines = baselines.loc[counties]
+            states = states.loc[counties]
+        
+        changed = {var: change for var, change in changes.items() if var in baselines.columns}
+        unknown = [var for var in changes if var not in changed]
+        if unknown:
+            print(f"Warning: Variables {unknown} not found in county baselines")
+        if not changed:
+            raise ValueError("No valid changes to simulate")
+        
+        new_values = pd.DataFrame({var: baselines[var] * (1 + float(change) / 100)
+                                   for var, change in changed.items()})
+        states = states.copy()
+        new_states = self.discretize_batch(new_values)
+        for var in changed:
+            # Counties without an observation of var stay unobserved for it
+            states[var] = new_states[var].where(baselines[var].notna(), -1)
+        return self._simulate_states(states)
+
+    def simulate_trajectory(self, changes, steps=10, baseline=50):
+        """Impacts along a linear ramp from no change to the target changes.
+
+        Every intermediate step is evaluated in one simulate_many batch, so steps
+        that land in the same bins share a single inference. Returns a list of
+        {'step', 'changes', 'impacts'} dicts for steps 1..steps.
+        """
+        known = {var: change for var, change in changes.items() if var in self.bins}
+        if not known:
+            print("Error in simulation: No valid changes to simulate")
+            return []
+        
+        fractions = np.arange(1, steps + 1) / steps
+        step_changes = pd.DataFrame({var: change * fractions for var, change in known.items()},
+                                    index=range(1, steps + 1))
+        impacts = self.simulate_many(step_changes, baseline=baseline)
+        
+        trajectory = []
+        for step in step_changes.index:
+            step_impacts = {var: (None if pd.isna(value) else value) for var, value in impacts.loc[step].items()}
+            trajectory.append({
+                'step': int(step),
+                'changes': step_changes.loc[step].to_dict(),
+                'impacts': step_impacts
+            })
+        return trajectory
+
     def get_feature_importance(self):
         """Get importance scores for different features"""
         # Use model structure to determine feature importance
-        importance = {}
-        for var in self.model.nodes():
-            importance[var] = len(self.model.get_children(var))
+        importance = {var: 0 for var in self.tables}
+        for table in self.tables.values():
+            for parent in table['variables'][1:]:
+                importance[parent] += 1
         return importance 
\ No newline at end of file
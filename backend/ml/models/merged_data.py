@@ -0,0 +1,30 @@
+import os
+import pandas as pd
+
+MERGED_PARQUET = 'merged_california_data.parquet'
+MERGED_CSV = 'merged_california_data.csv'
+
+
+def merged_data_path(directory):
+    """The merged dataset in directory, preferring Parquet over an exported CSV"""
+    parquet = os.path.join(directory, MERGED_PARQUET)
+    return parquet if os.path.exists(parquet) else os.path.join(directory, MERGED_CSV)
+
+
+def merged_columns(path):
+    """Column names of the merged dataset without reading its data"""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def read_merged_data(path, columns=None):
+    """Read the merged dataset, loading only columns (all when None).
+
+    Parquet keeps the float32/int32 types of the merge and reads just the
+    requested columns from disk; CSV exports are still accepted.
+    """
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns, low_memory=False)
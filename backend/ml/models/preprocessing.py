@@ -0,0 +1,136 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _robust_scale_params(values):
+    """RobustScaler(quantile_range=(25, 75)) center and scale of every column"""
+    q25, center, q75 = np.percentile(values, [25, 50, 75], axis=0)
+    scale = q75 - q25
+    scale[scale < 10 * np.finfo(scale.dtype).eps] = 1.0  # sklearn's handling of zero scale
+    return center, scale
+
+
+def _freedman_diaconis_bins(scaled):
+    """Freedman-Diaconis bin count per column, clamped to 3..10 (5 for degenerate data)"""
+    n = scaled.shape[0]
+    q75, q25 = np.percentile(scaled, [75, 25], axis=0)
+    iqr = q75 - q25
+    data_range = scaled.max(axis=0) - scaled.min(axis=0)
+    h = 2 * iqr / (n ** (1/3))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n_bins = np.clip(np.floor(data_range / h), 3, 10)
+    degenerate = (iqr == 0) | (h == 0) | (data_range == 0)
+    return np.where(degenerate, 5, n_bins).astype(int)
+
+
+def _quantile_edges(scaled, n_bins):
+    """KBinsDiscretizer(strategy='quantile') bin edges of every column.
+
+    Columns sharing a bin count get their percentiles in one call. Bins
+    narrower than 1e-8 are dropped and constant columns get a single bin,
+    as sklearn does.
+    """
+    edges = [None] * scaled.shape[1]
+    for bins in np.unique(n_bins):
+        columns = np.flatnonzero(n_bins == bins)
+        percentiles = np.percentile(scaled[:, columns], np.linspace(0, 100, bins + 1), axis=0)
+        for idx, col in enumerate(columns):
+            col_edges = percentiles[:, idx]
+            if col_edges[0] == col_edges[-1]:
+                edges[col] = np.array([-np.inf, np.inf])
+                continue
+            edges[col] = col_edges[np.ediff1d(col_edges, to_begin=np.inf) > 1e-8]
+    return edges
+
+
+def discretize_numeric(values):
+    """Clip, robust-scale and quantile-bin a 2D float array column-wise.
+
+    Missing values are filled with the column median and outliers are capped
+    at 1.5 IQR before scaling. Returns (codes, params) where params holds
+    center, scale, bin_edges and n_bins per column.
+    """
+    values = np.array(values, dtype=float)
+    medians = np.nanmedian(values, axis=0)
+    missing = np.isnan(values)
+    values[missing] = np.take(medians, np.nonzero(missing)[1])
+
+    # Outlier detection using IQR method, std dev (or 1.0) when the IQR is zero
+    q1, q3 = np.percentile(values, [25, 75], axis=0)
+    iqr = q3 - q1
+    std = values.std(axis=0)
+    iqr = np.where(iqr == 0, np.where(std == 0, 1.0, std), iqr)
+    values = np.clip(values, q1 - 1.5 * iqr, q3 + 1.5 * iqr)
+
+    center, scale = _robust_scale_params(values)
+    scaled = (values - center) / scale
+    n_bins = _freedman_diaconis_bins(scaled)
+    edges = _quantile_edges(scaled, n_bins)
+
+    # Bin index = number of inner edges <= value, for all columns at once
+    inner = np.full((scaled.shape[1], max(len(e) for e in edges) - 2), np.inf)
+    for col, col_edges in enumerate(edges):
+        inner[col, :len(col_edges) - 2] = col_edges[1:-1]
+    codes = (scaled[:, :, None] >= inner[None, :, :]).sum(axis=2)
+
+    params = [
+        {'center': float(center[col]), 'scale': float(scale[col]),
+         'bin_edges': edges[col], 'n_bins': int(n_bins[col])}
+        for col in range(scaled.shape[1])
+    ]
+    return codes, params
+
+
+def discretize_categorical(column):
+    """Map a non-numeric column to category codes, folding categories under 5% into 'Other'"""
+    filled_data = column.fillna(column.mode().iloc[0] if not column.mode().empty else "UNKNOWN")
+
+    # Combine rare categories
+    value_counts = filled_data.value_counts()
+    rare_categories = value_counts[value_counts < len(filled_data) * 0.05].index
+    filled_data = filled_data.replace(rare_categories, 'Other')
+
+    categories = filled_data.unique()
+    category_map = {cat: idx for idx, cat in enumerate(sorted(categories))}
+    return filled_data.map(category_map), {'type': 'categorical', 'mapping': category_map}
+
+
+def _discretize_chunk(values):
+    return discretize_numeric(values)
+
+
+def preprocess_columns(data, n_jobs=None, chunk_size=64):
+    """Discretize every column of a DataFrame.
+
+    Numeric columns are processed as 2D arrays in chunks of chunk_size
+    columns, one chunk per worker process. Returns (discretized_data,
+    discretizers) in the column order of data.
+    """
+    numeric = data.apply(pd.to_numeric, errors='coerce')
+    numeric_columns = [col for col in data.columns if numeric[col].notna().any()]
+    chunks = [numeric_columns[i:i + chunk_size] for i in range(0, len(numeric_columns), chunk_size)]
+    arrays = [numeric[chunk].to_numpy(dtype=float) for chunk in chunks]
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1 or len(chunks) <= 1:
+        results = [_discretize_chunk(values) for values in arrays]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(chunks))) as pool:
+            results = list(pool.map(_discretize_chunk, arrays))
+
+    columns = {}
+    discretizers = {}
+    for chunk, (codes, params) in zip(chunks, results):
+        for idx, col in enumerate(chunk):
+            columns[col] = codes[:, idx].astype(float)
+            discretizers[col] = params[idx]
+
+    # Non-numeric columns are rare and keep the per-column category handling
+    for col in data.columns:
+        if col not in columns:
+            columns[col], discretizers[col] = discretize_categorical(data[col])
+
+    discretized_data = pd.DataFrame({col: columns[col] for col in data.columns}, index=data.index)
+    return discretized_data, discretizers
@@ -0,0 +1,82 @@
+import numpy as np
+
+try:
+    from .sparse_cpd import is_sparse
+except ImportError:
+    from sparse_cpd import is_sparse
+
+
+def topological_order(tables):
+    """Variables ordered so every parent precedes its children"""
+    order = []
+    placed = set()
+    remaining = list(tables)
+    while remaining:
+        ready = [var for var in remaining if set(tables[var]['variables'][1:]) <= placed]
+        if not ready:
+            raise ValueError("Network contains a cycle")
+        order += ready
+        placed.update(ready)
+        remaining = [var for var in remaining if var not in placed]
+    return order
+
+
+def weighted_quantiles(values, weights, quantiles):
+    """Quantiles of a weighted sample (inverse of the weighted empirical CDF)"""
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    cumulative /= cumulative[-1]
+    index = np.searchsorted(cumulative, quantiles, side='left')
+    return values[order][np.minimum(index, len(values) - 1)]
+
+
+class LikelihoodWeightingSampler:
+    """Likelihood-weighted forward sampling over the NumPy CPD arrays.
+
+    Each batch draws all samples of a variable at once: the CPD column of
+    every sample's parent configuration is gathered with one fancy index,
+    unobserved variables are drawn from it, and observed variables multiply
+    the sample weights by their likelihood instead.
+    """
+
+    def __init__(self, tables, seed=None):
+        self.tables = tables
+        self.order = topological_order(tables)
+        self.states = {var: table['states'][var] for var, table in tables.items()}
+        self.rng = np.random.default_rng(seed)
+
+    def _conditional(self, var, samples, n_samples):
+        """(n_samples, card) rows of P(var | sampled parents)"""
+        table = self.tables[var]
+        parents = table['variables'][1:]
+        if is_sparse(table):
+            keys = (np.ravel_multi_index([samples[p] for p in parents], table['cards'][1:]) if parents
+                    else np.zeros(n_samples, dtype=np.int64))
+            position = np.minimum(np.searchsorted(table['keys'], keys), len(table['keys']) - 1)
+            found = table['keys'][position] == keys
+            return np.where(found[:, None], table['rows'][position], table['default'])
+        values = table['values']
+        if not parents:
+            return np.broadcast_to(values, (n_samples, values.shape[0]))
+        return values[(slice(None),) + tuple(samples[p] for p in parents)].T
+
+    def sample(self, evidence, n_samples):
+        """Draw n_samples given evidence {var: state index}.
+
+        Returns ({var: state index per sample}, normalized weights).
+        """
+        samples = {}
+        log_weights = np.zeros(n_samples)
+        for var in self.order:
+            probs = self._conditional(var, samples, n_samples)
+            if var in evidence:
+                samples[var] = np.full(n_samples, evidence[var], dtype=np.int64)
+                log_weights += np.log(probs[:, evidence[var]])
+                continue
+            cumulative = np.cumsum(probs, axis=1)
+            draws = self.rng.random(n_samples)[:, None] * cumulative[:, -1:]
+            samples[var] = np.minimum((cumulative < draws).sum(axis=1), probs.shape[1] - 1)
+
+        # Weights are normalized in log space to stay finite for unlikely evidence
+        weights = np.exp(log_weights - log_weights.max())
+        return samples, weights / weights.sum()
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+try:
+    from .inference import EnvironmentSimulator, MODEL_DIR, SHARED_DIR_ENV
+    from .artifact_bundle import BUNDLE_DIR, MANIFEST_FILE, copy_bundle, export_bundle
+    from .compile_table import TABLE_FILE, MANIFEST_FILE as TABLE_MANIFEST_FILE
+    from .sparse_cpd import SPARSE_FILE
+except ImportError:
+    from inference import EnvironmentSimulator, MODEL_DIR, SHARED_DIR_ENV
+    from artifact_bundle import BUNDLE_DIR, MANIFEST_FILE, copy_bundle, export_bundle
+    from compile_table import TABLE_FILE, MANIFEST_FILE as TABLE_MANIFEST_FILE
+    from sparse_cpd import SPARSE_FILE
+
+_simulator = None
+_simulator_lock = threading.Lock()
+
+# Only one background reload runs at a time
+_reload_lock = threading.Lock()
+# Per process: each gunicorn worker has its own simulator and status
+reload_status = {'state': 'idle', 'model_dir': None, 'loaded_at': None, 'error': None, 'pid': os.getpid()}
+
+
+def _shm_root():
+    """RAM-backed directory when available, otherwise the temp directory"""
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def publish_bundle(model_dir=None, shm_root=None):
+    """Place the model bundle (and compiled table) in a shared directory.
+
+    Run once in the master process before workers fork. Every worker then
+    memory-maps the same read-only files, so the CPD arrays and the lookup
+    table are held in memory once instead of once per worker. Returns the
+    shared model directory and exports it as ECOSIM_SHARED_DIR.
+    """
+    model_dir = model_dir or MODEL_DIR
+    bundle_dir = os.path.join(model_dir, BUNDLE_DIR)
+    if not os.path.exists(os.path.join(bundle_dir, MANIFEST_FILE)):
+        print("[INFO] No artifact bundle found, exporting one from the pickled model...")
+        simulator = EnvironmentSimulator(model_dir=model_dir, use_bundle=False)
+        export_bundle(simulator.tables, simulator.bins, simulator.key_variables, bundle_dir)
+
+    with open(os.path.join(bundle_dir, MANIFEST_FILE), 'r') as f:
+        checksum = json.load(f)['checksum']
+
+    # Directories are named by source directory and model checksum, so a republish of the
+    # same model is a no-op and other deployments on the host are left alone
+    shm_root = shm_root or _shm_root()
+    prefix = f"ecosim-{hashlib.sha256(os.path.abspath(model_dir).encode()).hexdigest()[:8]}-"
+    shared_dir = os.path.join(shm_root, f'{prefix}{checksum[:16]}')
+    if not os.path.exists(shared_dir):
+        staging_dir = tempfile.mkdtemp(prefix='.ecosim-', dir=os.path.dirname(shared_dir))
+        # Name the copy after what was actually copied, in case an export replaced the manifest meanwhile
+        checksum = copy_bundle(bundle_dir, os.path.join(staging_dir, BUNDLE_DIR))['checksum']
+        shared_dir = os.path.join(shm_root, f'{prefix}{checksum[:16]}')
+        for name in (TABLE_FILE, TABLE_MANIFEST_FILE):
+            if os.path.exists(os.path.join(model_dir, name)):
+                shutil.copy2(os.path.join(model_dir, name), os.path.join(staging_dir, name))
+        try:
+            os.rename(staging_dir, shared_dir)  # Atomic, workers never see a partial copy
+        except OSError:
+            shutil.rmtree(staging_dir, ignore_errors=True)  # Another process published first
+
+    _remove_superseded(shm_root, prefix, shared_dir)
+    os.environ[SHARED_DIR_ENV] = shared_dir
+    print(f"[INFO] Published shared model artifacts to {shared_dir}")
+    return shared_dir
+
+
+def _remove_superseded(shm_root, prefix, current_dir):
+    """Delete earlier shared copies of this model directory.
+
+    Unlinking only drops the names: workers still mapping an old copy keep
+    its pages until they swap in the new model, and the RAM-backed memory is
+    released once the last of them lets go.
+    """
+    for name in os.listdir(shm_root):
+        path = os.path.join(shm_root, name)
+        if name.startswith(prefix) and path != current_dir:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def get_simulator():
+    """Process-wide EnvironmentSimulator, attached to the shared artifacts when published"""
+    global _simulator
+    with _simulator_lock:
+        if _simulator is None:
+            shared_dir = os.getenv(SHARED_DIR_ENV)
+            if shared_dir and not os.path.exists(shared_dir):
+                # e.g. a worker respawned after a reload replaced the copy the master published
+                shared_dir = publish_bundle()
+            _simulator = EnvironmentSimulator(model_dir=shared_dir or None)
+            reload_status.update(model_dir=_simulator.model_dir, loaded_at=time.time(), pid=os.getpid())
+        return _simulator
+
+
+def warm_simulator(simulator, changes=range(-50, 51, 10)):
+    """Fill the evidence cache (and page in mapped arrays) with single-variable ramps"""
+    inputs = simulator.key_variables['environmental_pressure'] + simulator.key_variables['environmental_state']
+    changes = list(changes)
+    for var in inputs:
+        simulator.simulate_many(pd.DataFrame({var: np.asarray(changes, dtype=float)}))
+
+
+def _swap_in_new_simulator(warm):
+    global _simulator
+    try:
+        reload_status.update(state='loading', error=None)
+        # In shared mode publish the new artifacts first; the directory is keyed by checksum
+        model_dir = publish_bundle() if os.getenv(SHARED_DIR_ENV) else None
+        simulator = EnvironmentSimulator(model_dir=model_dir)
+        if warm:
+            reload_status['state'] = 'warming'
+            warm_simulator(simulator)
+        with _simulator_lock:
+            _simulator = simulator
+        reload_status.update(state='idle', model_dir=simulator.model_dir, loaded_at=time.time(), pid=os.getpid())
+        print(f"[INFO] Reloaded model from {simulator.model_dir}")
+        return True
+    except Exception as e:
+        reload_status.update(state='failed', error=str(e))
+        print(f"[ERROR] Model reload failed, keeping the current model: {str(e)}")
+        return False
+    finally:
+        _reload_lock.release()
+
+
+def reload_simulator(warm=True):
+    """Build a new simulator from the current artifacts, warm it, then swap it in.
+
+    Requests already holding the old instance finish on it; new lookups
+    through get_simulator() see the new one. Returns False if a reload is
+    already running or the new model fails to load.
+    """
+    if not _reload_lock.acquire(blocking=False):
+        return False
+    return _swap_in_new_simulator(warm)
+
+
+def start_reload(warm=True):
+    """Run the reload in a background thread; False if one is already running"""
+    if not _reload_lock.acquire(blocking=False):
+        return False
+    threading.Thread(target=_swap_in_new_simulator, args=(warm,), daemon=True).start()
+    return True
+
+
+def _artifact_signature(model_dir):
+    """Sizes and mtimes of the files a retrain rewrites"""
+    paths = [os.path.join(model_dir, BUNDLE_DIR, MANIFEST_FILE),
+             os.path.join(model_dir, 'bayesian_network.pkl'),
+             os.path.join(model_dir, 'discretizers.pkl'),
+             os.path.join(model_dir, SPARSE_FILE),
+             os.path.join(model_dir, TABLE_MANIFEST_FILE)]
+    signature = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append((path, stat.st_size, stat.st_mtime))
+    return tuple(signature)
+
+
+def watch_model_files(interval=10.0, model_dir=None):
+    """Poll the source model directory and reload once a retrain has finished writing"""
+    model_dir = model_dir or MODEL_DIR
+
+    def watch():
+        last = _artifact_signature(model_dir)
+        while True:
+            time.sleep(interval)
+            current = _artifact_signature(model_dir)
+            if current == last:
+                continue
+            # Wait until the files stop changing so a half-written retrain is never loaded
+            time.sleep(interval)
+            if _artifact_signature(model_dir) != current:
+                continue
+            last = current
+            print("[INFO] Model artifacts changed, reloading...")
+            reload_simulator()
+
+    thread = threading.Thread(target=watch, daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    # For servers without a master hook (e.g. uWSGI): publish, then export the printed path
+    print(publish_bundle())
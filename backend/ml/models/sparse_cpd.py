@@ -0,0 +1,72 @@
+import numpy as np
+
+SPARSE_FILE = 'sparse_cpds.pkl'
+
+
+def is_sparse(table):
+    return table.get('type') == 'sparse'
+
+
+def sparse_cpd_from_counts(node, parents, state_names, keys, counts, equivalent_sample_size=10):
+    """Build a BDeu CPD that stores only the parent configurations seen in the data.
+
+    keys/counts are the observed parent configurations and their state counts
+    (see FamilyCounts.sparse_counts). With a BDeu prior every unseen parent
+    configuration has the uniform distribution, so keeping one row per observed
+    configuration plus a uniform default is exact while costing O(rows)
+    instead of O(card * prod(parent cards)).
+    """
+    variables = [node] + list(parents)
+    cards = [len(state_names[var]) for var in variables]
+    node_card, parent_cards = cards[0], cards[1:]
+
+    alpha = float(equivalent_sample_size) / (node_card * np.prod(parent_cards, dtype=float))
+    rows = (counts + alpha) / (counts.sum(axis=1, keepdims=True) + alpha * node_card)
+
+    return {
+        'type': 'sparse',
+        'variables': variables,
+        'states': {var: list(state_names[var]) for var in variables},
+        'cards': cards,
+        'keys': np.asarray(keys, dtype=np.int64),
+        'rows': rows,
+        'default': np.full(node_card, 1.0 / node_card)
+    }
+
+
+def densify(table):
+    """Full [variable, *parents] array of a sparse CPD (for offline use only)"""
+    if not is_sparse(table):
+        return table['values']
+    cards = table['cards']
+    values = np.repeat(table['default'][:, None], int(np.prod(cards[1:], dtype=np.int64)), axis=1)
+    values[:, table['keys']] = table['rows'].T
+    return values.reshape(cards)
+
+
+def parent_codes(table):
+    """Parent state indices of each stored configuration, one column per parent"""
+    if len(table['cards']) == 1:
+        return np.zeros((len(table['keys']), 0), dtype=np.int64)
+    return np.stack(np.unravel_index(table['keys'], table['cards'][1:]), axis=1)
+
+
+def sparse_marginal(table, codes, parent_weights, free_parents, observed):
+    """Marginal of a sparse CPD's variable under a weighting of its parents.
+
+    parent_weights is an (unnormalized) array over the unobserved parents in
+    free_parents order, observed maps parent position -> observed state index.
+    Every configuration gets the default row, and stored configurations that
+    agree with the evidence replace it with their own row.
+    """
+    mask = np.ones(len(codes), dtype=bool)
+    for position, state in observed.items():
+        mask &= codes[:, position] == state
+
+    if free_parents:
+        weights = parent_weights[tuple(codes[mask][:, free_parents].T)]
+    else:
+        weights = np.full(mask.sum(), float(parent_weights))
+
+    total = float(np.sum(parent_weights))
+    return table['default'] * (total - weights.sum()) + weights @ table['rows'][mask]
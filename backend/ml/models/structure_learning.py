@@ -0,0 +1,107 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.special import gammaln
+from family_counts import FamilyCounts
+
+TIERS = ['environmental_pressure', 'environmental_state', 'impact']
+
+# Set in each worker process by _init_worker
+_counts = None
+
+
+def local_score(counts, node, parents, scoring='bic', equivalent_sample_size=10):
+    """Decomposable score of node given parents from cached family counts.
+
+    Parent configurations absent from the data contribute zero to K2 and BDeu,
+    so only the observed configurations are ever touched.
+    """
+    _, table = counts.sparse_counts(node, parents)
+    r = counts.cards[node]
+    q = counts.n_configurations(parents)
+    n_j = table.sum(axis=1)
+
+    if scoring == 'bic':
+        nonzero = table > 0
+        log_likelihood = np.sum(table[nonzero] * np.log((table / n_j[:, None])[nonzero]))
+        return log_likelihood - 0.5 * np.log(counts.n) * (r - 1) * q
+    if scoring == 'k2':
+        return np.sum(gammaln(r) - gammaln(n_j + r)) + np.sum(gammaln(table + 1))
+    if scoring == 'bdeu':
+        alpha_j = equivalent_sample_size / q
+        alpha_jk = alpha_j / r
+        return (np.sum(gammaln(alpha_j) - gammaln(n_j + alpha_j))
+                + np.sum(gammaln(table + alpha_jk) - gammaln(alpha_jk)))
+    raise ValueError(f"Unknown scoring method: {scoring}")
+
+
+def hill_climb_parents(counts, node, candidates, scoring='bic', max_parents=4, max_iter=100):
+    """Greedy add/remove/swap search for the best-scoring parent set of one node"""
+    parents = []
+    score = local_score(counts, node, parents, scoring)
+
+    for _ in range(max_iter):
+        moves = []
+        if len(parents) < max_parents:
+            moves += [parents + [c] for c in candidates if c not in parents]
+        moves += [[p for p in parents if p != removed] for removed in parents]
+        moves += [[c if p == removed else p for p in parents]
+                  for removed in parents for c in candidates if c not in parents]
+        if not moves:
+            break
+
+        scored = [(local_score(counts, node, sorted(move), scoring), sorted(move)) for move in moves]
+        best_score, best_parents = max(scored, key=lambda item: item[0])
+        if best_score <= score + 1e-9:
+            break
+        score, parents = best_score, best_parents
+
+    return parents, score
+
+
+def _init_worker(counts):
+    global _counts
+    _counts = counts
+
+
+def _search_node(args):
+    node, candidates, scoring, max_parents = args
+    return node, hill_climb_parents(_counts, node, candidates, scoring, max_parents)
+
+
+def learn_structure(data, key_variables, scoring='bic', max_parents=4, n_jobs=None):
+    """Learn the network edges by hill climbing within the pressure -> state -> impact order.
+
+    Parents of a node are restricted to variables of earlier tiers, which keeps
+    every candidate graph acyclic and makes the search decompose into one
+    independent parent-set search per node. Those searches run in a process
+    pool, each sharing the integer-encoded data and caching its family counts.
+    Returns (edges, scores).
+    """
+    counts = FamilyCounts(data)
+    jobs = []
+    earlier = []
+    for tier in TIERS:
+        for node in key_variables[tier]:
+            if earlier:
+                jobs.append((node, list(earlier), scoring, max_parents))
+        earlier += key_variables[tier]
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    print(f"[INFO] Learning structure ({scoring}, max {max_parents} parents) for {len(jobs)} nodes "
+          f"with {n_jobs} workers...")
+    if n_jobs == 1:
+        _init_worker(counts)
+        results = [_search_node(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(counts,)) as pool:
+            results = list(pool.map(_search_node, jobs))
+
+    edges = []
+    scores = {}
+    for node, (parents, score) in results:
+        edges += [(parent, node) for parent in parents]
+        scores[node] = score
+        print(f"  {node}: {len(parents)} parents")
+    print(f"[INFO] Learned {len(edges)} edges")
+    return edges, scores
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    from .inference import EnvironmentSimulator, MODEL_DIR
+    from .artifact_bundle import BUNDLE_DIR, MANIFEST_FILE, sha256_file
+    from .sparse_cpd import SPARSE_FILE
+except ImportError:
+    from inference import EnvironmentSimulator, MODEL_DIR
+    from artifact_bundle import BUNDLE_DIR, MANIFEST_FILE, sha256_file
+    from sparse_cpd import SPARSE_FILE
+
+CHECKPOINT_FILE = '_checkpoint.json'
+
+# Set in each worker process by _init_worker
+_simulator = None
+
+
+def model_fingerprint(model_dir):
+    """Identity of the model EnvironmentSimulator loads from model_dir.
+
+    The bundle manifest checksum when a bundle exists (that is what gets
+    loaded), otherwise the sha256 of each pickled artifact.
+    """
+    manifest_path = os.path.join(model_dir, BUNDLE_DIR, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            return {'bundle': json.load(f)['checksum']}
+    return {name: sha256_file(os.path.join(model_dir, name))
+            for name in ('bayesian_network.pkl', 'discretizers.pkl', SPARSE_FILE)
+            if os.path.exists(os.path.join(model_dir, name))}
+
+
+def sweep_config(variables, values, baseline=50, chunk_size=100000, model_dir=None):
+    """Everything that determines a sweep's results; a resumed run must match it exactly"""
+    model_dir = os.path.abspath(model_dir or MODEL_DIR)
+    return {
+        'variables': list(variables),
+        'values': [float(v) for v in values],
+        'baseline': baseline,
+        'chunk_size': int(chunk_size),
+        'model_dir': model_dir,
+        'model': model_fingerprint(model_dir)
+    }
+
+
+def _config_id(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def grid_chunk(config, chunk):
+    """Scenarios of one chunk, decoded from their mixed-radix index into a DataFrame"""
+    values = np.asarray(config['values'])
+    n_variables = len(config['variables'])
+    total = len(values) ** n_variables
+    start = chunk * config['chunk_size']
+    index = np.arange(start, min(start + config['chunk_size'], total), dtype=np.int64)
+    digits = np.unravel_index(index, (len(values),) * n_variables)
+    changes = pd.DataFrame({var: values[d] for var, d in zip(config['variables'], digits)})
+    changes.index = index
+    return changes
+
+
+def _init_worker(model_dir):
+    global _simulator
+    _simulator = EnvironmentSimulator(model_dir=model_dir)
+
+
+def _run_chunk(args):
+    config, chunk, out_dir = args
+    changes = grid_chunk(config, chunk)
+    impacts = _simulator.simulate_many(changes, baseline=config['baseline'])
+    result = pd.concat([changes, impacts], axis=1)
+    result.insert(0, 'scenario', changes.index)
+
+    # Write then rename, so a killed worker never leaves a partial partition behind
+    path = os.path.join(out_dir, f'part-{chunk:06d}.parquet')
+    result.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    return chunk
+
+
+def _load_checkpoint(out_dir, config):
+    path = os.path.join(out_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        checkpoint = json.load(f)
+    if checkpoint['config_id'] != _config_id(config):
+        if checkpoint['config'].get('model') != config['model']:
+            raise ValueError(f"{out_dir} was swept with a different model; use a new output directory "
+                             "or restart=True")
+        raise ValueError(f"{out_dir} holds a different sweep; use a new output directory or restart=True")
+    # Only trust chunks whose partition file actually exists
+    return {c for c in checkpoint['completed'] if os.path.exists(os.path.join(out_dir, f'part-{c:06d}.parquet'))}
+
+
+def _save_checkpoint(out_dir, config, completed, n_chunks):
+    path = os.path.join(out_dir, CHECKPOINT_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({
+            'config_id': _config_id(config),
+            'config': config,
+            'n_chunks': n_chunks,
+            'completed': sorted(completed),
+            'updated': time.time()
+        }, f)
+    os.replace(path + '.tmp', path)
+
+
+def run_sweep(variables, values, out_dir, baseline=50, chunk_size=100000, model_dir=None,
+              n_jobs=None, restart=False):
+    """Simulate every combination of values over variables into a Parquet dataset.
+
+    The len(values) ** len(variables) grid is split into chunks by scenario
+    index; each worker process decodes its chunk, runs one simulate_many batch
+    and writes part-NNNNNN.parquet. Completed chunks are checkpointed, so
+    rerunning the same sweep resumes where it stopped. Read the results with
+    pd.read_parquet(out_dir).
+    """
+    config = sweep_config(variables, values, baseline, chunk_size, model_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    if restart:
+        for name in os.listdir(out_dir):
+            if name.startswith('part-') or name == CHECKPOINT_FILE:
+                os.remove(os.path.join(out_dir, name))
+
+    total = len(config['values']) ** len(config['variables'])
+    n_chunks = -(-total // config['chunk_size'])
+    completed = _load_checkpoint(out_dir, config)
+    pending = [c for c in range(n_chunks) if c not in completed]
+    print(f"[INFO] Sweep of {total} scenarios in {n_chunks} chunks, {len(pending)} remaining")
+
+    with ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count() or 1, initializer=_init_worker,
+                             initargs=(config['model_dir'],)) as pool:
+        futures = [pool.submit(_run_chunk, (config, chunk, out_dir)) for chunk in pending]
+        for future in as_completed(futures):
+            completed.add(future.result())
+            _save_checkpoint(out_dir, config, completed, n_chunks)
+            print(f"[INFO] {len(completed)}/{n_chunks} chunks done")
+
+    # Workers loaded the model at the start; a retrain since then would make the partitions disagree
+    if model_fingerprint(config['model_dir']) != config['model']:
+        raise ValueError("The model changed during the sweep; rerun it with restart=True")
+
+    print(f"[SUCCESS] Sweep written to {out_dir}")
+    return out_dir
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a what-if grid over EnvironmentSimulator into Parquet")
+    parser.add_argument('--out', required=True, help="Output directory (reused to resume)")
+    parser.add_argument('--variables', nargs='*', default=None,
+                        help="Variables to sweep (defaults to all environmental_pressure variables)")
+    parser.add_argument('--low', type=float, default=-50)
+    parser.add_argument('--high', type=float, default=50)
+    parser.add_argument('--step', type=float, default=5)
+    parser.add_argument('--baseline', type=float, default=50)
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--model-dir', default=None)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--restart', action='store_true', help="Discard earlier results in --out")
+    args = parser.parse_args()
+
+    variables = args.variables
+    if not variables:
+        with open(os.path.join(args.model_dir or MODEL_DIR, 'key_variables.json'), 'r') as f:
+            variables = json.load(f)['environmental_pressure']
+    values = np.arange(args.low, args.high + args.step / 2, args.step)
+    run_sweep(variables, values, args.out, baseline=args.baseline, chunk_size=args.chunk_size,
+              model_dir=args.model_dir, n_jobs=args.jobs, restart=args.restart)
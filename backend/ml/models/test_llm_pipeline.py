@@ -88,17 +88,17 @@ class LLMPipelineTester:
     def test_simulation_pipeline(self, changes: Dict[str, float]) -> Optional[Dict]:
         """Test full simulation pipeline with given changes and enhanced visualization"""
         try:
-            # Run simulation
-            impacts = self.simulator.simulate_changes(changes)
+            # Run simulation; the posteriors carry their own confidence
+            distributions = self.simulator.simulate_distributions(changes)
             
-            if not impacts:
+            if not distributions:
                 print("No impacts generated from simulation")
                 return None
             
-            # Calculate confidence scores based on impact magnitudes
+            impacts = {var: (d['value'] if d else None) for var, d in distributions.items()}
             confidence_scores = {
-                var: min(abs(value) / 100, 1.0) 
-                for var, value in impacts.items()
+                var: (d['confidence'] if d else 0.0)
+                for var, d in distributions.items()
             }
             
             return {
@@ -0,0 +1,27 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from sensitivity import sobol
+
+
+class _LinearSimulator:
+    """Stand-in simulator: one impact follows the first input, the other never changes"""
+
+    key_variables = {'environmental_pressure': ['p1', 'p2'], 'environmental_state': [],
+                     'impact': ['varying', 'constant']}
+
+    def simulate_many(self, changes_df, baseline=50):
+        return pd.DataFrame({'varying': baseline + changes_df['p1'], 'constant': 50.0}, index=changes_df.index)
+
+
+def test_sobol_constant_impact_has_zero_indices():
+    results = sobol(_LinearSimulator(), samples=64, seed=0)
+    for var in ('p1', 'p2'):
+        assert results['constant'][var] == {'first': 0.0, 'total': 0.0}
+    assert results['varying']['p1']['total'] > 0.9
+    assert abs(results['varying']['p2']['total']) < 1e-12
+    # Must serialize as standard JSON (no NaN/Infinity)
+    json.dumps(results, allow_nan=False)
+    assert all(np.isfinite(v) for impact in results.values() for idx in impact.values() for v in idx.values())
@@ -0,0 +1,37 @@
+import numpy as np
+
+from inference import ImpactQuery
+from sparse_cpd import densify, sparse_cpd_from_counts
+
+
+def _network():
+    """Two roots A, B; sparse impact T | A, B (only (0, 1) and (1, 0) seen) and dense impact U | A"""
+    state_names = {'A': [0.0, 1.0], 'B': [0.0, 1.0, 2.0], 'T': [0.0, 1.0], 'U': [0.0, 1.0]}
+    keys = np.ravel_multi_index(([0, 1], [1, 0]), (2, 3))
+    counts = np.array([[8, 2], [1, 9]])
+    tables = {
+        'A': {'values': np.array([0.3, 0.7]), 'variables': ['A'], 'states': {'A': state_names['A']}},
+        'B': {'values': np.array([0.2, 0.5, 0.3]), 'variables': ['B'], 'states': {'B': state_names['B']}},
+        'T': sparse_cpd_from_counts('T', ['A', 'B'], state_names, keys, counts),
+        'U': {'values': np.array([[0.9, 0.4], [0.1, 0.6]]), 'variables': ['U', 'A'],
+              'states': {'U': state_names['U'], 'A': state_names['A']}}
+    }
+    dense = dict(tables, T=dict(tables['T'], type='tabular', values=densify(tables['T'])))
+    return tables, dense
+
+
+def _check_fully_observed(a, b):
+    tables, dense = _network()
+    evidence = {'A': a, 'B': b, 'T': 1.0}
+    sparse_marginals = ImpactQuery(tables, ['T', 'U']).query(evidence)
+    dense_marginals = ImpactQuery(dense, ['T', 'U']).query(evidence)
+    assert set(sparse_marginals) == {'U'}
+    np.testing.assert_allclose(sparse_marginals['U'], dense_marginals['U'])
+
+
+def test_sparse_node_observed_with_all_parents_seen_configuration():
+    _check_fully_observed(0.0, 1.0)
+
+
+def test_sparse_node_observed_with_all_parents_unseen_configuration():
+    _check_fully_observed(1.0, 2.0)
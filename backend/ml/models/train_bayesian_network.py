@@ -2,19 +2,21 @@ import pandas as pd
 import numpy as np
 from pgmpy.models import BayesianNetwork
 from pgmpy.factors.discrete import TabularCPD
-from pgmpy.estimators import MaximumLikelihoodEstimator, BayesianEstimator
-from sklearn.preprocessing import KBinsDiscretizer
+from pgmpy.estimators import MaximumLikelihoodEstimator
 import json
 import os
 import pickle
 from scipy import stats
-from sklearn.preprocessing import RobustScaler
+from artifact_bundle import BUNDLE_DIR, cpd_tables, export_bundle, export_discretizers
+from sparse_cpd import SPARSE_FILE, sparse_cpd_from_counts
+from family_counts import (COUNTS_FILE, FamilyCounts, bdeu_values, count_families,
+                           load_family_counts, save_family_counts, update_family_counts)
+from structure_learning import learn_structure
+from preprocessing import preprocess_columns
+from merged_data import merged_data_path, read_merged_data
 
 def prepare_data():
     """Prepare data for Bayesian Network with enhanced preprocessing"""
-    print("[INFO] Loading data...")
-    df = pd.read_csv('../merged_california_data.csv')
-    
     # Load our analysis to get categories
     with open('../dataset_analysis.json', 'r') as f:
         analysis = json.load(f)
@@ -42,88 +44,18 @@ def prepare_data():
         ]
     }
     
-    print("[INFO] Preparing variables for network...")
+    # Read only the key variables' columns of the merged dataset
+    print("[INFO] Loading data...")
     selected_columns = [col for category in key_variables.values() for col in category]
-    data = df[selected_columns].copy()
-    
-    # Enhanced preprocessing
-    discretized_data = pd.DataFrame()
-    discretizers = {}
+    data = read_merged_data(merged_data_path('..'), columns=selected_columns)
     
-    def safe_iqr(x):
-        """Calculate IQR safely handling NaN values"""
-        q75, q25 = np.nanpercentile(x, [75, 25])
-        return q75 - q25
+    print("[INFO] Preparing variables for network...")
     
-    for col in data.columns:
-        print(f"[INFO] Processing {col}")
-        numeric_data = pd.to_numeric(data[col], errors='coerce')
-        
-        if numeric_data.notna().sum() > 0:
-            # Fill NaN with median before processing
-            median_val = numeric_data.median()
-            numeric_data = numeric_data.fillna(median_val)
-            
-            # Outlier detection using IQR method
-            Q1 = np.nanpercentile(numeric_data, 25)
-            Q3 = np.nanpercentile(numeric_data, 75)
-            IQR = Q3 - Q1
-            if IQR == 0:  # Handle zero IQR case
-                IQR = np.nanstd(numeric_data) or 1.0  # Use std dev or 1.0 if std dev is 0
-            
-            lower_bound = Q1 - 1.5 * IQR
-            upper_bound = Q3 + 1.5 * IQR
-            
-            # Cap outliers instead of removing
-            numeric_data = numeric_data.clip(lower_bound, upper_bound)
-            
-            # Robust scaling to handle remaining outliers
-            scaler = RobustScaler(quantile_range=(25, 75))
-            scaled_data = scaler.fit_transform(numeric_data.values.reshape(-1, 1))
-            
-            # Safe bin calculation
-            n = len(scaled_data)
-            iqr_val = safe_iqr(scaled_data)
-            if iqr_val == 0:
-                n_bins = 5  # Default to 5 bins if data is too uniform
-            else:
-                h = 2 * iqr_val / (n ** (1/3))  # bin width
-                data_range = np.nanmax(scaled_data) - np.nanmin(scaled_data)
-                if h == 0 or data_range == 0:
-                    n_bins = 5  # Default for uniform data
-                else:
-                    n_bins = max(min(int(data_range / h), 10), 3)
-            
-            print(f"  Using {n_bins} bins for {col}")
-            
-            # Discretize using optimal bins
-            discretizer = KBinsDiscretizer(
-                n_bins=n_bins,
-                encode='ordinal',
-                strategy='quantile'  # More robust than 'uniform' for skewed data
-            )
-            discretized_values = discretizer.fit_transform(scaled_data).ravel()
-            discretizers[col] = {
-                'scaler': scaler,
-                'discretizer': discretizer,
-                'n_bins': n_bins
-            }
-            
-        else:  # Handle categorical data
-            # More sophisticated handling of categorical data
-            filled_data = data[col].fillna(data[col].mode().iloc[0] if not data[col].mode().empty else "UNKNOWN")
-            
-            # Combine rare categories
-            value_counts = filled_data.value_counts()
-            rare_categories = value_counts[value_counts < len(filled_data) * 0.05].index
-            filled_data = filled_data.replace(rare_categories, 'Other')
-            
-            categories = filled_data.unique()
-            category_map = {cat: idx for idx, cat in enumerate(sorted(categories))}
-            discretized_values = filled_data.map(category_map)
-            discretizers[col] = {'type': 'categorical', 'mapping': category_map}
-            
-        discretized_data[col] = discretized_values
+    # Quantiles, clipping, scaling and binning run on whole column chunks (see preprocessing.py)
+    discretized_data, discretizers = preprocess_columns(data)
+    for col, params in discretizers.items():
+        if 'n_bins' in params:
+            print(f"  Using {params['n_bins']} bins for {col}")
     
     print("\n[INFO] Variable Processing Summary:")
     for col in discretized_data.columns:
@@ -163,35 +95,206 @@ def create_network(key_variables):
     model = BayesianNetwork(edges)
     return model
 
-def train_network():
-    """Train Bayesian Network"""
-    # Prepare data
-    data, key_variables, discretizers = prepare_data()
-    
-    # Create network
-    model = create_network(key_variables)
+def learn_network(data, key_variables, scoring='bic', max_parents=4, n_jobs=None):
+    """Build the network from a data-driven structure search instead of the fixed layers"""
+    edges, _ = learn_structure(data, key_variables, scoring=scoring, max_parents=max_parents, n_jobs=n_jobs)
+    model = BayesianNetwork(edges)
+    # Variables without learned edges still need a (marginal) CPD
+    model.add_nodes_from([var for category in key_variables.values() for var in category])
+    return model
+
+def count_network(model, data, cpd_backend='tabular', sparse_min_parents=6, n_jobs=None):
+    """Compute the sufficient statistics of every CPD in the network.
+
+    Columns are integer-encoded once and each family is counted with a single
+    vectorized pass, one node per worker process. With cpd_backend='sparse',
+    nodes with at least sparse_min_parents parents (the impacts, with 9
+    parents and ~15M dense entries each) keep only the parent configurations
+    present in the data.
+    """
+    if cpd_backend not in ('tabular', 'sparse'):
+        raise ValueError(f"Unknown CPD backend: {cpd_backend}")
     
-    print("[INFO] Training network...")
-    # Fit model using Bayesian estimation for better handling of sparse data
-    model.fit(data=data, estimator=BayesianEstimator, prior_type='BDeu', equivalent_sample_size=10)
+    counts = FamilyCounts(data)
+    families = {}
+    for node in model.nodes():
+        parents = sorted(model.get_parents(node))  # Same axis order as pgmpy's CPDs
+        families[node] = (parents, cpd_backend == 'sparse' and len(parents) >= sparse_min_parents)
+    return count_families(counts, families, n_jobs), counts.state_names
+
+def fit_cpds(model, families, state_names, equivalent_sample_size=10):
+    """Set every CPD of the model from cached family counts with a BDeu prior.
+
+    Only normalizes the counts, so refitting with another equivalent_sample_size
+    is instant. Sparse CPDs are returned separately since pgmpy only stores
+    dense TabularCPDs.
+    """
+    if model.get_cpds():
+        model.remove_cpds(*model.get_cpds())
     
-    # Save discretizers for later use
+    sparse_cpds = {}
+    for node, family in families.items():
+        parents = family['parents']
+        if 'keys' in family:
+            sparse_cpds[node] = sparse_cpd_from_counts(node, parents, state_names, family['keys'],
+                                                       family['counts'], equivalent_sample_size)
+            print(f"[INFO] Sparse CPD for {node}: {len(family['keys'])} observed parent configurations")
+            continue
+        values = bdeu_values(family['counts'], equivalent_sample_size)
+        model.add_cpds(TabularCPD(
+            node, values.shape[0], values.reshape(values.shape[0], -1),
+            evidence=parents or None,
+            evidence_card=list(values.shape[1:]) or None,
+            state_names={var: list(state_names[var]) for var in [node] + parents}
+        ))
+    return sparse_cpds
+
+def save_artifacts(model, sparse_cpds, discretizers, key_variables, model_dir='../models'):
+    """Write the pickled model, the sparse CPDs and the fast-start bundle"""
     print("[INFO] Saving model artifacts...")
-    if not os.path.exists('../models'):
-        os.makedirs('../models')
+    if not os.path.exists(model_dir):
+        os.makedirs(model_dir)
         
-    with open('../models/bayesian_network.pkl', 'wb') as f:
+    with open(os.path.join(model_dir, 'bayesian_network.pkl'), 'wb') as f:
         pickle.dump(model, f)
     
-    with open('../models/discretizers.pkl', 'wb') as f:
+    with open(os.path.join(model_dir, 'discretizers.pkl'), 'wb') as f:
         pickle.dump(discretizers, f)
     
-    with open('../models/key_variables.json', 'w') as f:
+    with open(os.path.join(model_dir, 'key_variables.json'), 'w') as f:
         json.dump(key_variables, f, indent=2)
     
+    # Sparse CPDs live next to the model; drop a stale file from an earlier sparse run
+    sparse_path = os.path.join(model_dir, SPARSE_FILE)
+    if sparse_cpds:
+        with open(sparse_path, 'wb') as f:
+            pickle.dump(sparse_cpds, f)
+    elif os.path.exists(sparse_path):
+        os.remove(sparse_path)
+    
+    # Fast-start bundle used by EnvironmentSimulator when present
+    tables = cpd_tables(model)
+    tables.update(sparse_cpds)
+    export_bundle(tables, export_discretizers(discretizers), key_variables,
+                  os.path.join(model_dir, BUNDLE_DIR))
+
+def train_network(cpd_backend='tabular', sparse_min_parents=6, structure='fixed', scoring='bic', max_parents=4,
+                  equivalent_sample_size=10, n_jobs=None):
+    """Train Bayesian Network"""
+    # Prepare data
+    data, key_variables, discretizers = prepare_data()
+    
+    # Create network
+    if structure == 'learned':
+        model = learn_network(data, key_variables, scoring=scoring, max_parents=max_parents, n_jobs=n_jobs)
+    else:
+        model = create_network(key_variables)
+    
+    print("[INFO] Training network...")
+    families, state_names = count_network(model, data, cpd_backend, sparse_min_parents, n_jobs)
+    # Fit model using Bayesian estimation for better handling of sparse data
+    sparse_cpds = fit_cpds(model, families, state_names, equivalent_sample_size)
+    
+    save_artifacts(model, sparse_cpds, discretizers, key_variables)
+    # Counts are kept so the prior can be changed (or new rows added) without touching the data again
+    save_family_counts(os.path.join('../models', COUNTS_FILE), families, state_names, equivalent_sample_size)
+    
     print("[SUCCESS] Model training complete")
     return model, discretizers, key_variables
 
+def load_trained(model_dir='../models'):
+    """Load the pickled model, discretizers and key variables written by save_artifacts"""
+    with open(os.path.join(model_dir, 'bayesian_network.pkl'), 'rb') as f:
+        model = pickle.load(f)
+    with open(os.path.join(model_dir, 'discretizers.pkl'), 'rb') as f:
+        discretizers = pickle.load(f)
+    with open(os.path.join(model_dir, 'key_variables.json'), 'r') as f:
+        key_variables = json.load(f)
+    return model, discretizers, key_variables
+
+def refit_prior(equivalent_sample_size, model_dir='../models'):
+    """Refit every CPD with a new equivalent_sample_size from the saved family counts"""
+    counts_path = os.path.join(model_dir, COUNTS_FILE)
+    families, state_names, _ = load_family_counts(counts_path)
+    model, discretizers, key_variables = load_trained(model_dir)
+    
+    print(f"[INFO] Refitting CPDs with equivalent_sample_size={equivalent_sample_size}...")
+    sparse_cpds = fit_cpds(model, families, state_names, equivalent_sample_size)
+    save_artifacts(model, sparse_cpds, discretizers, key_variables, model_dir)
+    save_family_counts(counts_path, families, state_names, equivalent_sample_size)
+    return model
+
+def discretize_rows(data, discretizers):
+    """Discretize raw rows with the training discretizers (rows with missing values are dropped)"""
+    bins = export_discretizers(discretizers)
+    data = data[list(bins)].dropna()
+    discretized = {}
+    for var, params in bins.items():
+        if params['type'] == 'categorical':
+            discretized[var] = data[var].map(params['mapping'])
+        else:
+            scaled = (pd.to_numeric(data[var]).to_numpy(dtype=float) - params['center']) / params['scale']
+            # Training states are the bin indices as floats
+            discretized[var] = np.searchsorted(params['inner_edges'], scaled, side='right').astype(float)
+    return pd.DataFrame(discretized, index=data.index)
+
+def update_network(new_data, model_dir='../models', raw=False):
+    """Add a batch of new rows to the trained network without refitting it from scratch.
+
+    The saved Dirichlet counts are incremented by the batch and only the CPD
+    columns of the parent configurations it touched are renormalized, so the
+    update costs O(new rows) rather than a full pass over the merged data.
+    """
+    counts_path = os.path.join(model_dir, COUNTS_FILE)
+    families, state_names, equivalent_sample_size = load_family_counts(counts_path)
+    model, discretizers, key_variables = load_trained(model_dir)
+    if raw:
+        new_data = discretize_rows(new_data, discretizers)
+    
+    print(f"[INFO] Updating network with {len(new_data)} new rows...")
+    touched = update_family_counts(families, state_names, new_data)
+    
+    sparse_cpds = {}
+    for node, family in families.items():
+        if 'keys' in family:
+            sparse_cpds[node] = sparse_cpd_from_counts(node, family['parents'], state_names, family['keys'],
+                                                       family['counts'], equivalent_sample_size)
+            continue
+        cpd = model.get_cpds(node)
+        values = cpd.values.reshape(family['counts'].shape[0], -1).copy()
+        columns = touched[node]
+        values[:, columns] = bdeu_values(family['counts'], equivalent_sample_size, columns)
+        cpd.values = values.reshape(cpd.values.shape)
+    
+    save_artifacts(model, sparse_cpds, discretizers, key_variables, model_dir)
+    save_family_counts(counts_path, families, state_names, equivalent_sample_size)
+    print("[SUCCESS] Network update complete")
+    return model
+
 if __name__ == "__main__":
     print("[INFO] Starting Bayesian Network training...")
-    model, discretizers, key_variables = train_network() 
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Train the environmental Bayesian network")
+    parser.add_argument('--cpd-backend', choices=['tabular', 'sparse'], default='tabular',
+                        help="'sparse' stores high fan-in CPDs by observed parent configuration only")
+    parser.add_argument('--sparse-min-parents', type=int, default=6)
+    parser.add_argument('--structure', choices=['fixed', 'learned'], default='fixed',
+                        help="'learned' hill-climbs the edges instead of the fully connected layers")
+    parser.add_argument('--scoring', choices=['bic', 'k2', 'bdeu'], default='bic')
+    parser.add_argument('--max-parents', type=int, default=4)
+    parser.add_argument('--ess', type=float, default=10, help="BDeu equivalent sample size")
+    parser.add_argument('--jobs', type=int, default=None, help="Worker processes (defaults to all cores)")
+    parser.add_argument('--refit-prior', action='store_true',
+                        help="Only refit the CPDs with --ess from the saved family counts")
+    parser.add_argument('--update', metavar='CSV', default=None,
+                        help="Add the rows of a CSV to the trained network instead of retraining")
+    parser.add_argument('--raw', action='store_true', help="The --update CSV holds raw, undiscretized values")
+    args = parser.parse_args()
+    if args.update:
+        update_network(pd.read_csv(args.update), raw=args.raw)
+    elif args.refit_prior:
+        refit_prior(args.ess)
+    else:
+        model, discretizers, key_variables = train_network(args.cpd_backend, args.sparse_min_parents,
+                                                           args.structure, args.scoring, args.max_parents,
+                                                           args.ess, args.jobs)